@@ -0,0 +1,242 @@
+# Замеры производительности Storage и поиска на синтетических хранилищах. Работает без окна Flet.
+#
+#   python bench.py --sizes 100 1000 10000
+#   python bench.py --sizes 1000 100000 --backend sqlite --save baseline.json
+#   python bench.py --sizes 1000 100000 --compare baseline.json
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from storage import Storage, Record, DEFAULT_SETTINGS
+from utils import YAMLFile
+
+
+DOMAINS = ["gmail.com", "yandex.ru", "mail.ru", "outlook.com", "corp.example.org"]
+
+
+def random_word(rnd: random.Random, min_len: int = 3, max_len: int = 10) -> str:
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(min_len, max_len)))
+
+
+def generate_records(count: int, seed: int = 0) -> list[Record]:
+    rnd = random.Random(seed)
+    services = [random_word(rnd) for _ in range(max(10, count // 20))]
+    now = int(time.time())
+    return [
+        Record(
+            name=f"{rnd.choice(services)} {random_word(rnd)}",
+            login=f"{random_word(rnd)}.{random_word(rnd)}@{rnd.choice(DOMAINS)}",
+            password=random_word(rnd, 12, 20),
+            use_stamp=now - rnd.randint(0, 3 * 365 * 86400)
+        )
+        for _ in range(count)
+    ]
+
+
+def make_storage(dir_path: Path, backend: str, journal: bool) -> type[Storage]:
+    class BenchStorage(Storage):
+        pass
+
+    BenchStorage.dir_path = dir_path
+    BenchStorage.file_path = dir_path / "data.yml"
+    BenchStorage.snapshot_path = dir_path / "data.bin"
+    BenchStorage.journal_path = dir_path / "data.journal"
+    BenchStorage.db_path = dir_path / "data.db"
+    BenchStorage.backend_name = backend
+    BenchStorage.use_journal = journal
+    return BenchStorage
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    samples = sorted(samples)
+
+    def pick(q: float) -> float:
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    return {
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": samples[-1],
+        "mean": statistics.fmean(samples)
+    }
+
+
+def timeit(func: Callable, repeat: int, setup: Callable = None) -> list[float]:
+    samples = []
+    for i in range(repeat):
+        args = setup(i) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_memory(func: Callable) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def retained_memory(func: Callable) -> int:
+    # Память, которую занимает результат func, пока он жив
+    tracemalloc.start()
+    try:
+        result = func()
+        current = tracemalloc.get_traced_memory()[0]
+        del result
+        return current
+    finally:
+        tracemalloc.stop()
+
+
+def loaded_storage(storage_cls: type[Storage], index: bool) -> Storage:
+    storage = storage_cls()
+    if index:
+        storage.preload()
+    else:
+        storage.get_records()
+    return storage
+
+
+def bench_size(size: int, repeat: int, backend: str, journal: bool) -> dict:
+    results = {}
+    records = generate_records(size)
+    queries = [r.name.split()[0][:4] for r in records[:repeat]] or ["abc"]
+    typo_queries = [q[1] + q[0] + q[2:] for q in queries]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dir_path = Path(tmp)
+        storage_cls = make_storage(dir_path, backend, journal)
+        data = {
+            "settings": dict(DEFAULT_SETTINGS),
+            "records": [r.to_dict() for r in records]
+        }
+        file = YAMLFile(dir_path / "data.yml")
+
+        results["yaml_write"] = timeit(lambda: file.write(data), max(1, repeat // 10))
+        results["yaml_read"] = timeit(file.read, max(1, repeat // 10))
+
+        # Первый запуск строит снимок или базу, последующие загружаются так же, как при старте приложения
+        storage_cls().get_records()
+        results["cold_get_settings"] = timeit(lambda: storage_cls().get_settings(), max(1, repeat // 10))
+        results["cold_get_records"] = timeit(lambda: storage_cls().get_records(), max(1, repeat // 10))
+        results["cold_load_peak_bytes"] = peak_memory(lambda: storage_cls().get_records())
+        # Память загруженного хранилища в расчете на одну запись: записи и порядок, затем вместе с индексом
+        results["record_bytes"] = retained_memory(lambda: loaded_storage(storage_cls, False)) // size
+        results["record_with_index_bytes"] = retained_memory(lambda: loaded_storage(storage_cls, True)) // size
+
+        storage = storage_cls()
+        storage.get_records()
+        # Построение поискового индекса, которое приложение делает в фоне при запуске
+        results["preload_index"] = timeit(storage.preload, 1)
+        results["get_settings"] = timeit(storage.get_settings, repeat)
+        results["get_records"] = timeit(storage.get_records, repeat)
+        # Первая порция карточек списка
+        results["get_records_page"] = timeit(lambda: storage.get_records(30), repeat)
+        # То же, что делает RecordListPage при вводе в поле фильтра
+        results["filter"] = timeit(storage.search, repeat, lambda i: (queries[i % len(queries)],))
+        results["filter_fuzzy"] = timeit(
+            lambda q: storage.rank(q, 50), repeat, lambda i: (typo_queries[i % len(typo_queries)],)
+        )
+
+        extra = generate_records(repeat, seed=1)
+        extra_flushed = generate_records(repeat, seed=2)
+        results["add_record"] = timeit(storage.add_record, repeat, lambda i: (extra[i],))
+        results["add_record_flush"] = timeit(
+            lambda r: (storage.add_record(r), storage.flush()), repeat, lambda i: (extra_flushed[i],)
+        )
+        targets = records[:repeat]
+        results["update_use_time"] = timeit(
+            storage.update_use_time, repeat, lambda i: (storage.get_record(targets[i].id),)
+        )
+        results["update_use_time_flush"] = timeit(
+            lambda r: (storage.update_use_time(r), storage.flush()), repeat,
+            lambda i: (storage.get_record(targets[i].id),)
+        )
+        results["delete_record_flush"] = timeit(
+            lambda r: (storage.delete_record(r), storage.flush()), repeat,
+            lambda i: (storage.get_record(extra[i].id),)
+        )
+        storage.close()
+
+    return {
+        op: value if isinstance(value, int) else percentiles(value)
+        for op, value in results.items()
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for size, ops in current.items():
+        for op, value in ops.items():
+            base = baseline.get(size, {}).get(op)
+            if base is None:
+                continue
+            now, before = (value, base) if isinstance(value, int) else (value["p50"], base["p50"])
+            if before and now > before * (1 + tolerance):
+                regressions.append(f"{size} {op}: {format_value(op, before)} -> {format_value(op, now)}")
+    return regressions
+
+
+def format_value(op: str, value: float) -> str:
+    if op.startswith("record_"):
+        return f"{value} B"
+    if op.endswith("_bytes"):
+        return f"{value / 1024 / 1024:.1f} MB"
+    return f"{value * 1000:.3f} ms"
+
+
+def print_report(results: dict) -> None:
+    for size, ops in results.items():
+        print(f"\n== {size} records ==")
+        for op, value in ops.items():
+            if isinstance(value, int):
+                print(f"{op:<24} {format_value(op, value)}")
+            else:
+                print(f"{op:<24} " + "  ".join(f"{k}={format_value(op, v)}" for k, v in value.items()))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Amnesia storage benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--backend", choices=["yaml", "sqlite"], default="yaml")
+    parser.add_argument("--journal", action="store_true")
+    parser.add_argument("--save", type=Path, help="save results as JSON")
+    parser.add_argument("--compare", type=Path, help="compare p50 with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    results = {
+        str(size): bench_size(size, args.repeat, args.backend, args.journal)
+        for size in args.sizes
+    }
+    print_report(results)
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.tolerance)
+        print("\nRegressions:" if regressions else "\nNo regressions")
+        for line in regressions:
+            print("  " + line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+import perf
+from config import clipboard_clear_delay
+from utils import Debouncer
+
+
+# Буфер обмена. pyperclip на Linux запускает xclip или xsel, поэтому буфер меняется в фоновом потоке,
+# а обработчик клика не ждет процесса. Из нескольких ожидающих значений копируется только последнее
+class Clipboard:
+
+    def __init__(self, clear_delay: float) -> None:
+        self._clear_delay = clear_delay
+        self._writer = Debouncer(self._write, 0)
+        # Скопированный пароль стирается из буфера через clear_delay секунд. Любое новое копирование
+        # отменяет или переносит очистку
+        self._cleaner = Debouncer(self._clear, clear_delay)
+        self._lock = threading.Lock()
+        # Запись и очистка не выполняются одновременно, иначе очистка может стереть более новое значение
+        self._io_lock = threading.Lock()
+        self._generation = 0
+        self._secret: Optional[str] = None
+
+    def copy(self, text: str, secret: bool = False) -> None:
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._secret = text if secret else None
+        if secret and self._clear_delay > 0:
+            self._cleaner.trigger(generation)
+        else:
+            self._cleaner.cancel()
+        self._writer.trigger(text)
+
+    def clear(self) -> None:
+        self.copy("")
+
+    @perf.timed("clipboard.write")
+    def _write(self, text: str) -> None:
+        import pyperclip
+
+        with self._io_lock:
+            pyperclip.copy(text)
+
+    @perf.timed("clipboard.clear")
+    def _clear(self, generation: int) -> None:
+        import pyperclip
+
+        with self._io_lock:
+            with self._lock:
+                if generation != self._generation:
+                    return
+                secret, self._secret = self._secret, None
+            # Если пользователь успел скопировать что-то в другом приложении, буфер не трогается
+            if pyperclip.paste() == secret:
+                pyperclip.copy("")
+
+
+clipboard = Clipboard(clipboard_clear_delay)
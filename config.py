@@ -1 +1,24 @@
 app_dir = ".amnesia"
+
+# Способ хранения данных: "yaml" или "sqlite"
+backend = "yaml"
+
+# Дописывать изменения в журнал вместо перезаписи всего файла данных
+journal = False
+# Размер журнала в байтах, после которого он переносится в файл данных
+journal_limit = 256 * 1024
+# Пауза в секундах после последнего изменения, через которую данные записываются на диск
+flush_delay = 0.5
+# Как часто в секундах проверять, не изменили ли файл данных снаружи. Между проверками
+# все чтения обслуживаются из памяти, сколько бы сеансов ни было открыто в веб-режиме
+reload_interval = 1.0
+# Пауза в секундах после изменения файла данных снаружи, через которую он перечитывается
+watch_delay = 0.3
+# Порядок записей в списке: "recency" - по времени последнего использования,
+# "frecency" - по частоте использования с учетом давности
+order = "recency"
+# Сколько хранилищ держать загруженными в памяти. Записи остальных хранилищ освобождаются
+# и загружаются заново при переключении на них
+vault_cache_size = 3
+# Через сколько секунд стирать скопированный пароль из буфера обмена. 0 - не стирать
+clipboard_clear_delay = 30.0
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+
+# Параметры scrypt. Ключ выводится один раз при разблокировке и хранится до конца сеанса
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+KEY_SIZE = 32
+NONCE_SIZE = 12
+
+# Зашифрованное значение: префикс и base64(nonce + шифротекст AES-GCM)
+TOKEN_PREFIX = "aes:"
+# Контрольное значение для проверки пин-кода
+CHECK_TEXT = "amnesia"
+CHECK_CONTEXT = "check"
+
+
+def new_salt() -> str:
+    return os.urandom(16).hex()
+
+
+def derive_key(pin: str, salt: str) -> bytes:
+    return hashlib.scrypt(
+        pin.encode("utf-8"),
+        salt=bytes.fromhex(salt),
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        maxmem=128 * SCRYPT_N * SCRYPT_R * 2,
+        dklen=KEY_SIZE
+    )
+
+
+def is_encrypted(value: str) -> bool:
+    return value.startswith(TOKEN_PREFIX)
+
+
+class PasswordCipher:
+
+    def __init__(self, key: bytes) -> None:
+        # cryptography импортируется только для зашифрованных хранилищ
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self._aead = AESGCM(key)
+
+    # context - id записи. Зашифрованный пароль нельзя перенести в другую запись
+    def encrypt(self, text: str, context: str) -> str:
+        nonce = os.urandom(NONCE_SIZE)
+        blob = nonce + self._aead.encrypt(nonce, text.encode("utf-8"), context.encode("utf-8"))
+        return TOKEN_PREFIX + base64.b64encode(blob).decode("ascii")
+
+    def decrypt(self, token: str, context: str) -> str:
+        # При неверном ключе или поврежденном значении выбрасывает cryptography.exceptions.InvalidTag
+        blob = base64.b64decode(token[len(TOKEN_PREFIX):])
+        nonce, data = blob[:NONCE_SIZE], blob[NONCE_SIZE:]
+        return self._aead.decrypt(nonce, data, context.encode("utf-8")).decode("utf-8")
+
+    def make_check(self) -> str:
+        return self.encrypt(CHECK_TEXT, CHECK_CONTEXT)
+
+    def verify(self, check: str) -> bool:
+        from cryptography.exceptions import InvalidTag
+
+        try:
+            return self.decrypt(check, CHECK_CONTEXT) == CHECK_TEXT
+        except (InvalidTag, ValueError):
+            return False
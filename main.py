@@ -1,15 +1,45 @@
+import os
+import time
+
+# Режим профилирования запуска: cProfile работает от начала импорта модулей до показа первого экрана
+START_TIME = time.perf_counter()
+if os.environ.get("AMNESIA_PROFILE"):
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+else:
+    profiler = None
+
 import flet as ft
 from loguru import logger
 
-import ui
+import perf
 from storage import storage
 
 
 logger.add("error.log", format="{time} {level} {message}", level="ERROR")
+if os.environ.get("AMNESIA_PERF"):
+    perf.enable(log_path="perf.log", report_path="perf.txt")
+
+
+def dump_startup_profile() -> None:
+    # В веб-режиме main вызывается для каждого сеанса, а профиль запуска сохраняется только для первого
+    global profiler
+    import pstats
+
+    startup_profiler, profiler = profiler, None
+    startup_profiler.disable()
+    startup_profiler.dump_stats("startup.prof")
+    with open("startup.txt", "w") as file:
+        file.write(f"First screen after {(time.perf_counter() - START_TIME) * 1000:.0f} ms\n\n")
+        pstats.Stats(startup_profiler, stream=file).sort_stats("cumulative").print_stats(60)
 
 
 @logger.catch
 def main(page: ft.Page):
+    # Интерфейс импортируется только после выбора режима запуска
+    import ui
+
     page.title = "Amnesia"
     page.theme_mode = "dark"
     page.padding = 10
@@ -25,6 +55,9 @@ def main(page: ft.Page):
 
     page.update()
 
+    if profiler is not None:
+        dump_startup_profile()
+
 
 if __name__ == '__main__':
     settings = storage.get_settings()
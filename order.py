@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import math
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+# Период полураспада веса использования для frecency, в секундах
+FRECENCY_HALF_LIFE = 30 * 86400
+FRECENCY_RATE = math.log(2) / FRECENCY_HALF_LIFE
+
+
+def frecency_key(use_stamp: float, previous: Optional[float] = None) -> float:
+    # Логарифм суммы весов всех использований, где вес использования в момент t равен exp(rate * t).
+    # Каждое использование добавляет вес, старые использования со временем теряют значение относительно новых.
+    # Порядок записей по такому ключу не меняется сам по себе, поэтому его не нужно пересчитывать
+    key = FRECENCY_RATE * use_stamp
+    if previous is None:
+        return key
+    high, low = max(key, previous), min(key, previous)
+    return high + math.log1p(math.exp(low - high))
+
+
+# Размер блока RecordOrder. Блок делится пополам, когда становится вдвое больше
+ORDER_BLOCK_SIZE = 1000
+
+
+# id записей, упорядоченные по ключу, от большего к меньшему.
+# Пары (ключ, id) хранятся по возрастанию в блоках не длиннее 2 * ORDER_BLOCK_SIZE, а наибольший элемент каждого
+# блока - в _maxes. Нужный блок находится бинарным поиском, вставка и удаление сдвигают элементы только внутри
+# него, поэтому использование записи не зависит от числа записей линейно. Запись с новым наибольшим ключом
+# (только что использованная) дописывается в конец последнего блока
+class RecordOrder:
+
+    def __init__(self) -> None:
+        self._blocks: list[list[tuple[float, str]]] = []
+        self._maxes: list[tuple[float, str]] = []
+        self._keys: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[str]:
+        for block in reversed(self._blocks):
+            for _, record_id in reversed(block):
+                yield record_id
+
+    def key(self, record_id: str) -> Optional[float]:
+        return self._keys.get(record_id)
+
+    def build(self, items: Iterable[tuple[str, float]]) -> None:
+        self._keys = dict(items)
+        ordered = sorted((key, record_id) for record_id, key in self._keys.items())
+        self._blocks = [ordered[i:i + ORDER_BLOCK_SIZE] for i in range(0, len(ordered), ORDER_BLOCK_SIZE)]
+        self._maxes = [block[-1] for block in self._blocks]
+
+    def set(self, record_id: str, key: float) -> None:
+        self.remove(record_id)
+        self._keys[record_id] = key
+        item = (key, record_id)
+        if not self._blocks:
+            self._blocks.append([item])
+            self._maxes.append(item)
+            return
+        i = bisect_left(self._maxes, item)
+        if i == len(self._blocks):
+            i -= 1
+            self._blocks[i].append(item)
+        else:
+            insort(self._blocks[i], item)
+        block = self._blocks[i]
+        self._maxes[i] = block[-1]
+        if len(block) > 2 * ORDER_BLOCK_SIZE:
+            self._blocks[i:i + 1] = [block[:ORDER_BLOCK_SIZE], block[ORDER_BLOCK_SIZE:]]
+            self._maxes[i:i + 1] = [self._blocks[i][-1], self._blocks[i + 1][-1]]
+
+    def remove(self, record_id: str) -> None:
+        key = self._keys.pop(record_id, None)
+        if key is None:
+            return
+        item = (key, record_id)
+        i = bisect_left(self._maxes, item)
+        block = self._blocks[i]
+        del block[bisect_left(block, item)]
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def clear(self) -> None:
+        self._blocks.clear()
+        self._maxes.clear()
+        self._keys.clear()
+
+    def first(self, limit: Optional[int] = None) -> list[str]:
+        return list(islice(self, limit))
+
+    def arrange(self, record_ids: set[str]) -> list[str]:
+        # Располагает подмножество записей в общем порядке. Большие выборки берутся проходом по порядку,
+        # небольшие сортируются по ключу
+        if len(record_ids) * 8 > len(self._keys):
+            return [record_id for record_id in self if record_id in record_ids]
+        return sorted(record_ids, key=lambda record_id: (self._keys[record_id], record_id), reverse=True)
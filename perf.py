@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import math
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+
+# Замеры времени горячих операций. Выключены по умолчанию: тогда декоратор timed и span
+# сводятся к одной проверке флага
+
+_enabled = False
+_lock = threading.Lock()
+_stats: dict[str, OpStats] = {}
+_logger = None
+_report_path: Optional[Path] = None
+
+BUCKETS = 32
+
+
+class OpStats:
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # buckets[i] - число вызовов длительностью от 2^(i-1) до 2^i микросекунд
+        self.buckets = [0] * BUCKETS
+
+    def add(self, duration: float) -> None:
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        micros = duration * 1_000_000
+        self.buckets[min(BUCKETS - 1, max(0, math.ceil(math.log2(micros)) if micros > 1 else 0))] += 1
+
+    def quantile(self, q: float) -> float:
+        # Верхняя граница корзины, в которую попадает квантиль, в секундах
+        threshold = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= threshold:
+                return min(2 ** i / 1_000_000, self.max)
+        return self.max
+
+
+class Span:
+
+    def __init__(self, operation: str, fields: dict) -> None:
+        self.operation = operation
+        self.fields = fields
+        self._start = 0.0
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __enter__(self) -> Span:
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        record(self.operation, time.perf_counter() - self._start, **self.fields)
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+
+class NullSpan:
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __enter__(self) -> NullSpan:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def set(self, **fields) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def enable(log_path: Optional[str] = None, report_path: Optional[str] = None) -> None:
+    # log_path - файл для событий в формате JSON (пишется в фоне через loguru),
+    # report_path - файл для сводки, которая записывается при выходе и по сигналу SIGUSR1
+    global _enabled, _logger, _report_path
+    if log_path:
+        from loguru import logger
+        # Уровень TRACE, чтобы события не попадали в остальные обработчики loguru
+        logger.add(
+            log_path,
+            level="TRACE",
+            format="{message}",
+            enqueue=True,
+            filter=lambda r: "perf" in r["extra"]
+        )
+        _logger = logger.bind(perf=True)
+    if report_path:
+        _report_path = Path(report_path)
+        atexit.register(dump)
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda *args: dump())
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def record(operation: str, duration: float, **fields) -> None:
+    with _lock:
+        stats = _stats.get(operation)
+        if stats is None:
+            stats = _stats[operation] = OpStats()
+        stats.add(duration)
+    if _logger is not None:
+        event = {"time": time.time(), "operation": operation, "duration_ms": round(duration * 1000, 3), **fields}
+        _logger.trace(json.dumps(event))
+
+
+def span(operation: str, **fields) -> Span | NullSpan:
+    if not _enabled:
+        return NULL_SPAN
+    return Span(operation, fields)
+
+
+def timed(operation: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(operation, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def report() -> str:
+    with _lock:
+        items = sorted(_stats.items(), key=lambda item: item[1].total, reverse=True)
+        lines = [f"{'operation':<36}{'count':>8}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for operation, s in items:
+            lines.append(
+                f"{operation:<36}{s.count:>8}{s.total * 1000:>12.1f}{s.total / s.count * 1000:>10.3f}"
+                f"{s.quantile(0.5) * 1000:>10.3f}{s.quantile(0.95) * 1000:>10.3f}{s.max * 1000:>10.3f}"
+            )
+    return "\n".join(lines)
+
+
+def dump() -> None:
+    if _report_path is not None:
+        _report_path.write_text(report() + "\n")
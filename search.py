@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import heapq
+import re
+import time
+from collections import defaultdict
+from typing import Iterable, Callable, Union
+
+
+def normalize(text: str) -> str:
+    return text.lower()
+
+
+def char_mask(text: str) -> int:
+    # Множество символов в виде битовой маски. Разные символы могут попасть в один бит,
+    # поэтому число отсутствующих символов по маске не больше настоящего
+    mask = 0
+    for char in set(text):
+        mask |= 1 << (ord(char) & 63)
+    return mask
+
+
+def matches(query: str, *texts: str) -> bool:
+    query = normalize(query)
+    return any(query in normalize(text) for text in texts)
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def tokenize(text: str) -> tuple[str, ...]:
+    return tuple(token for token in re.split(r"[\W_]+", text) if token)
+
+
+def max_typos(query: str) -> int:
+    return (len(query) + 1) // 4
+
+
+def fuzzy_distance(pattern: str, text: str, limit: int) -> int:
+    # Наименьшее число правок (вставка, удаление, замена, перестановка соседних символов),
+    # за которое pattern превращается в какую-либо подстроку text.
+    # Если оно больше limit, возвращается limit + 1
+    m = len(pattern)
+    prev2 = prev = list(range(m + 1))
+    best = prev[m]
+    for j, tc in enumerate(text, 1):
+        col = [0] * (m + 1)
+        for i in range(1, m + 1):
+            pc = pattern[i - 1]
+            value = min(prev[i] + 1, col[i - 1] + 1, prev[i - 1] + (pc != tc))
+            if i > 1 and j > 1 and pc == text[j - 2] and pattern[i - 2] == tc:
+                value = min(value, prev2[i - 2] + 1)
+            col[i] = value
+        best = min(best, col[m])
+        if best == 0:
+            return 0
+        prev2, prev = prev, col
+    return min(best, limit + 1)
+
+
+def _lowered(text: str) -> str:
+    # Строка, которая уже в нижнем регистре, не копируется
+    lowered = normalize(text)
+    return text if lowered == text else lowered
+
+
+# Индекс для поиска подстроки в имени или логине записи.
+# Для каждой триграммы хранится множество id записей, в имени или логине которых она встречается
+class SearchIndex:
+
+    def __init__(self) -> None:
+        self._fields: dict[str, tuple[str, str]] = {}
+        self._postings: defaultdict[str, set[str]] = defaultdict(set)
+        # Для нечеткого поиска: слова имени и логина каждой записи и словарь всех слов.
+        # Расстояние до запроса считается один раз для каждого различного слова.
+        # Большинство слов встречается в одной записи, для них вместо множества хранится сам id
+        self._tokens: dict[str, tuple[str, ...]] = {}
+        self._vocab: dict[str, Union[str, set[str]]] = {}
+        self._vocab_chars: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def add(self, record_id: str, name: str, login: str) -> None:
+        if record_id in self._fields:
+            self.remove(record_id)
+        fields = (_lowered(name), _lowered(login))
+        self._fields[record_id] = fields
+        self._tokens[record_id] = tokenize(fields[0]) + tokenize(fields[1])
+        for token in self._tokens[record_id]:
+            ids = self._vocab.get(token)
+            if ids is None:
+                self._vocab[token] = record_id
+                self._vocab_chars[token] = char_mask(token)
+            elif isinstance(ids, set):
+                ids.add(record_id)
+            elif ids != record_id:
+                self._vocab[token] = {ids, record_id}
+        for gram in trigrams(fields[0]) | trigrams(fields[1]):
+            self._postings[gram].add(record_id)
+
+    def remove(self, record_id: str) -> None:
+        fields = self._fields.pop(record_id, None)
+        if fields is None:
+            return
+        for token in self._tokens.pop(record_id):
+            ids = self._vocab.get(token)
+            if ids is None:
+                continue
+            if isinstance(ids, set):
+                ids.discard(record_id)
+                if len(ids) == 1:
+                    self._vocab[token] = next(iter(ids))
+            elif ids == record_id:
+                del self._vocab[token]
+                del self._vocab_chars[token]
+        for gram in trigrams(fields[0]) | trigrams(fields[1]):
+            ids = self._postings[gram]
+            ids.discard(record_id)
+            if not ids:
+                del self._postings[gram]
+
+    def clear(self) -> None:
+        self._fields.clear()
+        self._postings.clear()
+        self._tokens.clear()
+        self._vocab.clear()
+        self._vocab_chars.clear()
+
+    def search(self, query: str) -> set[str]:
+        # Возвращает id записей, имя или логин которых содержат query без учета регистра
+        query = normalize(query)
+        if not query:
+            return set(self._fields)
+        candidates: Iterable[str] = self._fields
+        if len(query) >= 3:
+            postings = []
+            for gram in trigrams(query):
+                if gram not in self._postings:
+                    return set()
+                postings.append(self._postings[gram])
+            postings.sort(key=len)
+            candidates = set.intersection(*postings)
+        result = set()
+        for record_id in candidates:
+            name, login = self._fields[record_id]
+            if (query in name) or (query in login):
+                result.add(record_id)
+        return result
+
+    def rank(self, query: str, k: int, use_stamp: Callable[[str], float]) -> list[str]:
+        # Возвращает не более k id записей, лучших по качеству совпадения с query и давности использования.
+        # Допускаются опечатки, пропущенные символы и перестановки соседних символов.
+        # Если в запросе несколько слов, запись должна совпасть с каждым из них
+        query = normalize(query)
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            # Пустой запрос или запрос только из разделителей ("@", "-", "."): опечатки не ищутся,
+            # подходящие записи упорядочиваются по давности использования
+            return heapq.nlargest(k, self.search(query), key=use_stamp)
+
+        distances = self._token_distances(query_tokens[0])
+        for query_token in query_tokens[1:]:
+            other = self._token_distances(query_token)
+            distances = {
+                record_id: distance + other[record_id]
+                for record_id, distance in distances.items()
+                if record_id in other
+            }
+        for record_id in self.search(query):
+            distances[record_id] = 0
+
+        length = sum(map(len, query_tokens))
+        now = time.time()
+
+        def scored() -> Iterable[tuple[float, str]]:
+            for record_id, distance in distances.items():
+                score = 1 - distance / length
+                if any(token.startswith(query_tokens[0]) for token in self._tokens[record_id]):
+                    score += 0.5
+                elif distance == 0:
+                    score += 0.25
+                age_days = (now - use_stamp(record_id)) / 86400
+                score += 0.3 / (1 + max(age_days, 0) / 30)
+                yield score, record_id
+
+        return [record_id for _, record_id in heapq.nlargest(k, scored())]
+
+    def _token_distances(self, query_token: str) -> dict[str, int]:
+        # Число опечаток в лучшем совпадении query_token со словами каждой подходящей записи.
+        # Точное вхождение находится по триграммам, совпадения с опечатками - по словарю слов
+        distances = dict.fromkeys(self.search(query_token), 0)
+        limit = max_typos(query_token)
+        if not limit:
+            return distances
+        query_mask = char_mask(query_token)
+        for token, ids in self._vocab.items():
+            # Каждая опечатка убирает из совпадения не больше одного символа запроса
+            if len(token) < len(query_token) - limit or bin(query_mask & ~self._vocab_chars[token]).count("1") > limit:
+                continue
+            distance = fuzzy_distance(query_token, token, limit)
+            if distance > limit:
+                continue
+            for record_id in ((ids,) if isinstance(ids, str) else ids):
+                if distances.get(record_id, limit + 1) > distance:
+                    distances[record_id] = distance
+        return distances
@@ -1,105 +1,1046 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import atexit
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
+from typing import Optional, Callable
 
-from config import app_dir
-from utils import YAMLFile, DatetimeFormatter
+from loguru import logger
 
+import perf
+from crypto import PasswordCipher, derive_key, new_salt, is_encrypted
+from config import (
+    app_dir, backend, journal, journal_limit, flush_delay, reload_interval, watch_delay, order, vault_cache_size
+)
+from order import RecordOrder, frecency_key
+from search import SearchIndex, normalize
+from utils import YAMLFile, SnapshotFile, JournalFile, Debouncer, FileWatcher, to_stamp, stamp_to_str
 
-@dataclass
+
+# Имя основного хранилища (файлы в папке приложения) и допустимые имена остальных
+DEFAULT_VAULT = "main"
+VAULT_NAME = re.compile(r"[\w-]+")
+
+
+def new_record_id() -> str:
+    return uuid.uuid4().hex
+
+
+# Записей могут быть сотни тысяч, поэтому у записи нет __dict__ (__slots__),
+# а одинаковые логины (обычно это несколько адресов почты) хранятся одной строкой
 class Record:
-    name: str
-    login: str
-    password: str
-    use_time: datetime
+
+    __slots__ = ("name", "login", "password", "use_stamp", "id", "frecency")
+
+    def __init__(self,
+                 name: str,
+                 login: str,
+                 password: str,
+                 use_stamp: int,
+                 id: Optional[str] = None,
+                 frecency: float = 0.0
+                 ) -> None:
+        self.name = name
+        self.login = sys.intern(login)
+        self.password = password
+        # Время последнего использования в секундах Unix. datetime создается только при обращении к use_time
+        self.use_stamp = use_stamp
+        self.id = id or new_record_id()
+        # Ключ порядка по частоте и давности использования, см. order.frecency_key.
+        # Для новых записей и записей из старых файлов считается, что запись использовали один раз
+        self.frecency = frecency or frecency_key(use_stamp)
+
+    def __repr__(self) -> str:
+        return f"Record(name={self.name!r}, login={self.login!r}, use_stamp={self.use_stamp}, id={self.id!r})"
 
     def __eq__(self, other: Record) -> bool:
-        if (self.name, self.login, self.password) == (other.name, other.login, other.password):
-            return True
-        return False
+        return self.id == other.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    @property
+    def use_time(self) -> datetime:
+        return datetime.fromtimestamp(self.use_stamp)
 
     @classmethod
     def from_dict(cls, dct: dict) -> Record:
-        df = DatetimeFormatter()
         return Record(
-            name=dct["name"],
-            login=dct["login"],
-            password=dct["password"],
-            use_time=df.str_2_dt(dct["use_time"])
+            # Записям из файлов, созданных до появления id, id присваивается при загрузке
+            id=dct.get("id") or new_record_id(),
+            # В файле, отредактированном вручную, YAML разбирает числа без кавычек как числа
+            name=_text(dct["name"]),
+            login=_text(dct["login"]),
+            password=_text(dct["password"]),
+            use_stamp=to_stamp(dct["use_time"]),
+            frecency=dct.get("frecency") or 0.0
         )
 
     def to_dict(self) -> dict:
-        df = DatetimeFormatter()
         return {
+            "id": self.id,
             "name": self.name,
             "login": self.login,
             "password": self.password,
-            "use_time": df.dt_2_str(self.use_time)
+            "use_time": stamp_to_str(self.use_stamp),
+            "frecency": self.frecency
         }
 
+    # Компактное представление для снимка и базы: кортеж в порядке ROW_FIELDS, время - число
+    @classmethod
+    def from_row(cls, row: tuple) -> Record:
+        id_, name, login, password, use_stamp, frecency = row
+        return Record(name, login, password, use_stamp, id_, frecency)
+
+    def to_row(self) -> tuple:
+        return self.id, self.name, self.login, self.password, self.use_stamp, self.frecency
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value)
+
+
+DEFAULT_SETTINGS = {"pin": "0000", "web_mode": False, "encrypted": False}
+
 
 @dataclass
 class Settings:
     pin: str
     web_mode: bool
+    # В зашифрованном хранилище пароли записей зашифрованы ключом, выведенным из пин-кода.
+    # Сам пин-код не хранится, его проверяет контрольное значение check
+    encrypted: bool = False
+    salt: str = ""
+    check: str = ""
 
     @classmethod
     def from_dict(cls, dct: dict) -> Settings:
         return Settings(
             pin=dct["pin"],
-            web_mode=dct["web_mode"]
+            web_mode=dct["web_mode"],
+            # Пароли хранилища с солью уже зашифрованы: "encrypted: false" в файле данных их не расшифрует
+            encrypted=dct.get("encrypted", False) or bool(dct.get("salt")),
+            salt=dct.get("salt", ""),
+            check=dct.get("check", "")
         )
 
     def to_dict(self) -> dict:
         return {
             "pin": self.pin,
-            "web_mode": self.web_mode
+            "web_mode": self.web_mode,
+            "encrypted": self.encrypted,
+            "salt": self.salt,
+            "check": self.check
         }
 
 
-class Storage:
+# Способ хранения данных на диске. Storage держит данные в памяти и передает сюда изменения
+class Backend(ABC):
 
-    dir_path = Path.home() / app_dir
-    file_path = dir_path / "data.yml"
+    # Файл для ручного редактирования (пятая кнопка на панели)
+    file_path: Path
+
+    # Отпечаток состояния на диске. Меняется, если данные изменили снаружи
+    @abstractmethod
+    def stamp(self) -> tuple:
+        ...
+
+    @abstractmethod
+    def load(self) -> tuple[Settings, list[Record]]:
+        ...
+
+    # Читает только настройки, не разбирая записи
+    @abstractmethod
+    def load_settings(self) -> Settings:
+        ...
 
-    def __init__(self):
-        self.dir_path.mkdir(exist_ok=True)
-        self._file = YAMLFile(self.file_path)
+    # Читает id, имена и логины записей без паролей. Нужно для поиска по хранилищу, которое не загружено
+    @abstractmethod
+    def load_index(self) -> list[tuple[str, str, str]]:
+        ...
+
+    @abstractmethod
+    def save(self, settings: Settings, records: list[Record]) -> None:
+        ...
+
+    # Сохраняет пачку изменений. entry - {"op": "add" | "delete" | "touch", "record": {...}}
+    @abstractmethod
+    def persist(self, settings: Settings, records: list[Record], entries: list[dict]) -> None:
+        ...
+
+    # Приводит file_path в актуальное состояние перед ручным редактированием
+    @abstractmethod
+    def sync_file(self, settings: Settings, records: list[Record]) -> None:
+        ...
+
+    # Стирает с диска остатки удаленных данных, например открытые пароли после шифрования.
+    # Файлы YAML и снимок переписываются целиком, им это не нужно
+    def purge(self) -> None:
+        pass
+
+
+class YAMLBackend(Backend):
+
+    def __init__(self, file_path: Path, snapshot_path: Path, journal_path: Optional[Path] = None) -> None:
+        self.file_path = file_path
+        self._file = YAMLFile(file_path)
+        # Двоичная копия data.yml. Используется, пока data.yml не изменят снаружи
+        self._snapshot = SnapshotFile(snapshot_path)
+        # В режиме журнала изменения дописываются в отдельный файл, а data.yml перезаписывается
+        # только при уплотнении журнала
+        self._journal = JournalFile(journal_path) if journal_path else None
         if not self._file.path.exists():
             self._file.write({
-                "settings": {"pin": "0000", "web_mode": False},
+                "settings": DEFAULT_SETTINGS,
                 "records": []
             })
 
-    def get_settings(self) -> Settings:
-        return Settings.from_dict(self._file.read()["settings"])
+    def stamp(self) -> tuple:
+        if self._journal is None:
+            return self._file.stamp()
+        return self._file.stamp(), self._journal.stamp()
 
-    def get_records(self) -> list[Record]:
-        records = [Record.from_dict(dct) for dct in self._file.read()["records"]]
-        records.sort(key=lambda x: x.use_time, reverse=True)
-        return records
+    def load(self) -> tuple[Settings, list[Record]]:
+        stamp = self._file.stamp()
+        data = self._snapshot.read(stamp)
+        migrate = False
+        if data is not None:
+            settings = Settings.from_dict(data["settings"])
+            records = [Record.from_row(row) for row in data["records"]]
+        else:
+            data = self._file.read()
+            settings = Settings.from_dict(data["settings"])
+            records = [Record.from_dict(dct) for dct in data["records"]]
+            self._write_snapshot(stamp, settings, records)
+            # В старых файлах settings записаны после records и не читаются отдельно
+            migrate = next(iter(data)) != "settings" or not all("id" in dct for dct in data["records"])
+        if self._journal is not None:
+            index = {r.id: r for r in records}
+            for entry in self._journal.read():
+                apply_change(index, entry["op"], Record.from_dict(entry["record"]))
+            records = list(index.values())
+        # Файл переписывается после применения журнала: save очищает журнал
+        if migrate:
+            self.save(settings, records)
+        return settings, records
 
-    def set_records(self, records: list[Record]) -> None:
-        data = self._file.read()
-        data["records"] = [r.to_dict() for r in records]
+    def load_settings(self) -> Settings:
+        stamp = self._file.stamp()
+        data = self._snapshot.read(stamp, ["settings"])
+        if data is not None:
+            return Settings.from_dict(data["settings"])
+        return _read_file_settings(self._file)
+
+    def load_index(self) -> list[tuple[str, str, str]]:
+        data = self._snapshot.read(self._file.stamp(), ["index"])
+        if data is None:
+            # Снимка нет или он устарел: данные загружаются целиком, снимок записывается заново
+            _, records = self.load()
+            return [(r.id, r.name, r.login) for r in records]
+        rows = data["index"]
+        if self._journal is not None:
+            index = {row[0]: row for row in rows}
+            for entry in self._journal.read():
+                dct = entry["record"]
+                if entry["op"] == "add":
+                    index[dct["id"]] = (dct["id"], dct["name"], dct["login"])
+                elif entry["op"] == "delete":
+                    index.pop(dct["id"], None)
+            rows = list(index.values())
+        return rows
+
+    def save(self, settings: Settings, records: list[Record]) -> None:
+        data = {
+            "settings": settings.to_dict(),
+            "records": [r.to_dict() for r in records]
+        }
         self._file.write(data)
+        self._write_snapshot(self._file.stamp(), settings, records)
+        if self._journal is not None:
+            self._journal.clear()
+
+    def persist(self, settings: Settings, records: list[Record], entries: list[dict]) -> None:
+        if self._journal is None:
+            self.save(settings, records)
+            return
+        self._journal.append(entries)
+        if self._journal.size() > journal_limit:
+            self.save(settings, records)
+
+    def sync_file(self, settings: Settings, records: list[Record]) -> None:
+        if self._journal is not None and self._journal.exists():
+            self.save(settings, records)
+
+    def _write_snapshot(self, stamp: tuple[int, int], settings: Settings, records: list[Record]) -> None:
+        # Секция index идет перед records, чтобы поиск по незагруженному хранилищу не читал пароли
+        self._snapshot.write(stamp, {
+            "settings": settings.to_dict(),
+            "index": [(r.id, r.name, r.login) for r in records],
+            "records": [r.to_row() for r in records]
+        })
+
+
+class SQLiteBackend(Backend):
+
+    def __init__(self, db_path: Path, file_path: Path) -> None:
+        # data.yml остается форматом импорта/экспорта: он выгружается перед ручным редактированием,
+        # а после правок загружается обратно в базу
+        self.file_path = file_path
+        self._file = YAMLFile(file_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Удаленные и замененные строки затираются нулями, а не остаются в свободных страницах файла
+        self._conn.execute("PRAGMA secure_delete = ON")
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            """ + self._records_sql)
+            self._migrate()
+            # Записи читаются в память целиком, запросы к базе ищут запись только по id. Индексы по времени,
+            # имени и логину из прежних версий удаляются: поиск подстроки их не использует, а запись замедляют
+            self._conn.executescript("""
+                DROP INDEX IF EXISTS records_key;
+                DROP INDEX IF EXISTS records_use_time;
+                DROP INDEX IF EXISTS records_name;
+                DROP INDEX IF EXISTS records_login;
+                CREATE UNIQUE INDEX IF NOT EXISTS records_id ON records (id);
+            """)
+            if not self._conn.execute("SELECT 1 FROM settings").fetchone():
+                self._write_settings(Settings.from_dict(DEFAULT_SETTINGS))
+
+    def stamp(self) -> tuple:
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return data_version, self._file_stamp()
+
+    def load(self) -> tuple[Settings, list[Record]]:
+        if self._file_stamp() not in (None, self._get_meta("file_stamp")):
+            self._import_file()
+        settings = self._read_settings()
+        records = [
+            Record.from_row(row)
+            for row in self._conn.execute("SELECT id, name, login, password, use_time, frecency FROM records")
+        ]
+        return settings, records
+
+    def load_settings(self) -> Settings:
+        # Импорт измененного data.yml выполняется при полной загрузке
+        if self._file_stamp() not in (None, self._get_meta("file_stamp")):
+            return _read_file_settings(self._file)
+        return self._read_settings()
+
+    def load_index(self) -> list[tuple[str, str, str]]:
+        if self._file_stamp() not in (None, self._get_meta("file_stamp")):
+            self._import_file()
+        return self._conn.execute("SELECT id, name, login FROM records").fetchall()
+
+    def save(self, settings: Settings, records: list[Record]) -> None:
+        with self._conn:
+            self._write_settings(settings)
+            self._write_records(records)
+
+    def persist(self, settings: Settings, records: list[Record], entries: list[dict]) -> None:
+        with self._conn:
+            for entry in entries:
+                record = Record.from_dict(entry["record"])
+                if entry["op"] == "add":
+                    self._conn.execute(self._insert_sql, record.to_row())
+                elif entry["op"] == "delete":
+                    self._conn.execute("DELETE FROM records WHERE id = ?", (record.id,))
+                elif entry["op"] == "touch":
+                    self._conn.execute(
+                        "UPDATE records SET use_time = ?, frecency = ? WHERE id = ?",
+                        (record.use_stamp, record.frecency, record.id)
+                    )
+
+    def sync_file(self, settings: Settings, records: list[Record]) -> None:
+        self._file.write({
+            "settings": settings.to_dict(),
+            "records": [r.to_dict() for r in records]
+        })
+        with self._conn:
+            self._set_meta("file_stamp", self._file_stamp())
+
+    def purge(self) -> None:
+        # Страницы, освобожденные до включения secure_delete, убираются пересборкой базы
+        self._conn.execute("VACUUM")
+
+    _records_sql = """
+        CREATE TABLE IF NOT EXISTS records (
+            name TEXT NOT NULL,
+            login TEXT NOT NULL,
+            password TEXT NOT NULL,
+            use_time INTEGER NOT NULL,
+            id TEXT NOT NULL DEFAULT '',
+            frecency REAL NOT NULL DEFAULT 0
+        );
+    """
+
+    _insert_sql = """
+        INSERT INTO records (id, name, login, password, use_time, frecency)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+
+    def _migrate(self) -> None:
+        # В базах, созданных до появления id и frecency, эти колонки добавляются. id заполняется сразу,
+        # frecency - при загрузке записей
+        columns = {row[1]: row[2] for row in self._conn.execute("PRAGMA table_info(records)")}
+        if "id" not in columns:
+            self._conn.execute("ALTER TABLE records ADD COLUMN id TEXT NOT NULL DEFAULT ''")
+        if "frecency" not in columns:
+            self._conn.execute("ALTER TABLE records ADD COLUMN frecency REAL NOT NULL DEFAULT 0")
+        self._conn.execute("UPDATE records SET id = lower(hex(randomblob(16))) WHERE id = ''")
+        if columns["use_time"] != "INTEGER":
+            # Раньше время хранилось строкой. Колонка с типом TEXT превращает числа обратно в строки,
+            # поэтому таблица пересоздается
+            rows = self._conn.execute("SELECT id, name, login, password, use_time, frecency FROM records").fetchall()
+            self._conn.execute("DROP TABLE records")
+            self._conn.execute(self._records_sql)
+            self._conn.executemany(
+                self._insert_sql,
+                [(id_, name, login, password, to_stamp(use_time), frecency)
+                 for id_, name, login, password, use_time, frecency in rows]
+            )
+
+    def _file_stamp(self) -> Optional[list[int]]:
+        if not self._file.path.exists():
+            return None
+        return list(self._file.stamp())
+
+    def _get_meta(self, key: str):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, key: str, value) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _import_file(self) -> None:
+        data = self._file.read()
+        with self._conn:
+            self._write_settings(Settings.from_dict(data["settings"]))
+            self._write_records([Record.from_dict(dct) for dct in data["records"]])
+            self._set_meta("file_stamp", self._file_stamp())
+
+    def _read_settings(self) -> Settings:
+        return Settings.from_dict({
+            key: json.loads(value)
+            for key, value in self._conn.execute("SELECT key, value FROM settings")
+        })
+
+    def _write_settings(self, settings: Settings) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO settings VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in settings.to_dict().items()]
+        )
+
+    def _write_records(self, records: list[Record]) -> None:
+        self._conn.execute("DELETE FROM records")
+        self._conn.executemany(self._insert_sql, [r.to_row() for r in records])
+
+
+def _read_file_settings(file: YAMLFile) -> Settings:
+    # Файлы, где settings записаны после records, разбираются целиком.
+    # Такие файлы переписываются в новом порядке при полной загрузке
+    dct = file.read_first("settings")
+    if dct is None:
+        dct = file.read()["settings"]
+    return Settings.from_dict(dct)
+
+
+def apply_change(records: dict[str, Record], op: str, record: Record) -> None:
+    if op == "add":
+        records[record.id] = record
+    elif op == "delete":
+        records.pop(record.id, None)
+    elif op == "touch":
+        # Запись могли удалить снаружи или в другом сеансе, пока ее использовали
+        current = records.get(record.id)
+        if current is not None:
+            current.use_stamp = record.use_stamp
+            current.frecency = record.frecency
+
+
+# Результат перечитывания файла данных после правки снаружи: id добавленных, удаленных и измененных записей.
+# Если файл не удалось разобрать, заполнено только error, а данные в памяти остаются прежними
+@dataclass
+class FileChange:
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+# Хранилища процесса, изменения которых записываются при выходе. Ссылки слабые,
+# чтобы брошенное хранилище освобождалось вместе с записями
+_storages: weakref.WeakSet[Storage] = weakref.WeakSet()
+
+
+def _flush_storages() -> None:
+    for storage in list(_storages):
+        try:
+            storage.flush()
+        except Exception:
+            logger.exception("Failed to save changes on exit")
+
+
+atexit.register(_flush_storages)
+
+
+class Storage:
+
+    dir_path = Path.home() / app_dir
+    file_path = dir_path / "data.yml"
+    snapshot_path = dir_path / "data.bin"
+    journal_path = dir_path / "data.journal"
+    db_path = dir_path / "data.db"
+    backend_name = backend
+    use_journal = journal
+    order_by = order
+
+    def __init__(self, dir_path: Optional[Path] = None) -> None:
+        # Хранилище в другой папке (см. Vaults). По умолчанию используются пути класса
+        if dir_path is not None:
+            self.dir_path = dir_path
+            self.file_path = dir_path / "data.yml"
+            self.snapshot_path = dir_path / "data.bin"
+            self.journal_path = dir_path / "data.journal"
+            self.db_path = dir_path / "data.db"
+        # Файлы открываются при первом обращении к данным, а не при создании объекта
+        self._backend: Optional[Backend] = None
+        self._backend_lock = threading.Lock()
+        # Данные с диска. Являются основными, пока их не изменят снаружи.
+        # Поисковый индекс строится при первом поиске или в фоне через preload
+        self._settings: Optional[Settings] = None
+        self._records: dict[str, Record] = {}
+        self._index = SearchIndex()
+        self._index_ready = False
+        # Порядок записей поддерживается при каждом изменении, поэтому чтения не сортируют записи
+        self._order = RecordOrder()
+        self._stamp: Optional[tuple] = None
+        self._checked_at = 0.0
+        # Пока записи не загружены, настройки читаются отдельно и не ждут загрузки записей
+        self._settings_lock = threading.Lock()
+        self._settings_stamp: Optional[tuple] = None
+        # Имена и логины для поиска по хранилищу, пока оно не загружено (см. find)
+        self._rows_lock = threading.Lock()
+        self._index_rows: list[tuple[str, str, str]] = []
+        self._index_rows_stamp: Optional[tuple] = None
+        # Ключ зашифрованного хранилища на время сеанса. Пароли расшифровываются по одному при обращении
+        self._cipher: Optional[PasswordCipher] = None
+        # Изменения, которые еще не записаны на диск. Серия изменений записывается одним разом
+        # после паузы flush_delay
+        self._lock = threading.RLock()
+        self._pending: list[dict] = []
+        self._pending_save = False
+        # Каждое изменение возвращает Future, который завершается, когда изменение записано на диск
+        self._waiters: list[Future] = []
+        self._writing = False
+        self._write_lock = threading.RLock()
+        self._flusher = Debouncer(self.flush, flush_delay)
+        _storages.add(self)
+        # Пока работает наблюдатель за файлом данных, чтения не проверяют файл на диске
+        self._watcher: Optional[FileWatcher] = None
+        self._listeners: list[Callable[[FileChange], None]] = []
+        self._broken_stamp: Optional[tuple] = None
+
+    @perf.timed("storage.get_settings")
+    def get_settings(self) -> Settings:
+        if self._stamp is None:
+            with self._settings_lock:
+                backend = self._get_backend()
+                stamp = backend.stamp()
+                if stamp != self._settings_stamp:
+                    with perf.span("storage.load_settings"):
+                        self._settings = backend.load_settings()
+                    self._settings_stamp = stamp
+                return self._settings
+        with self._lock:
+            self._load()
+            return self._settings
+
+    @perf.timed("storage.unlock")
+    def unlock(self, pin: str) -> bool:
+        settings = self.get_settings()
+        if not settings.encrypted:
+            return pin == settings.pin
+        if not settings.salt:
+            # Шифрование включили в файле данных: пароли шифруются после ввода текущего пин-кода
+            if pin != settings.pin:
+                return False
+            self._encrypt_vault(pin)
+            return True
+        cipher = PasswordCipher(derive_key(pin, settings.salt))
+        if not cipher.verify(settings.check):
+            return False
+        self._cipher = cipher
+        return True
+
+    def reveal_password(self, record: Record) -> str:
+        # Пароли, добавленные в файл данных вручную, хранятся открыто
+        if not is_encrypted(record.password):
+            return record.password
+        if self._cipher is None:
+            raise Exception("The vault is locked")
+        with perf.span("storage.reveal_password"):
+            return self._cipher.decrypt(record.password, record.id)
+
+    @perf.timed("storage.get_records")
+    def get_records(self, limit: Optional[int] = None) -> list[Record]:
+        with self._lock:
+            self._load()
+            return [self._records[record_id] for record_id in self._order.first(limit)]
+
+    @property
+    def loaded(self) -> bool:
+        return self._stamp is not None
+
+    def get_record(self, record_id: str) -> Optional[Record]:
+        with self._lock:
+            self._load()
+            return self._records.get(record_id)
+
+    def order_item(self, record_id: str) -> tuple[float, str]:
+        # Записи идут по убыванию этой пары. Удаленная запись считается последней
+        with self._lock:
+            key = self._order.key(record_id)
+        return (float("-inf") if key is None else key), record_id
+
+    def preload(self) -> None:
+        with self._lock:
+            self._load()
+            self._ensure_index()
+
+    @perf.timed("storage.search")
+    def search(self, filter_string: str) -> list[Record]:
+        with self._lock:
+            self._load()
+            # Без фильтра поисковый индекс не нужен
+            if not filter_string:
+                return [self._records[record_id] for record_id in self._order]
+            self._ensure_index()
+            ids = self._order.arrange(self._index.search(filter_string))
+            return [self._records[record_id] for record_id in ids]
+
+    @perf.timed("storage.find")
+    def find(self, filter_string: str) -> list[str]:
+        # id записей, имя или логин которых содержат filter_string. Незагруженное хранилище
+        # не загружается: имена и логины читаются с диска отдельно от паролей
+        with self._lock:
+            if self._stamp is not None:
+                self._load()
+                self._ensure_index()
+                return list(self._index.search(filter_string))
+            backend = self._get_backend()
+        query = normalize(filter_string)
+        return [record_id for record_id, name, login in self._get_index_rows(backend) if query in name or query in login]
+
+    def _get_index_rows(self, backend: Backend) -> list[tuple[str, str, str]]:
+        # Имена и логины незагруженного хранилища в нижнем регистре. Поиск по другим хранилищам выполняется
+        # при каждом вводе в поле фильтра, поэтому с диска они читаются заново, только когда файл изменился
+        stamp = backend.stamp()
+        with self._rows_lock:
+            if stamp != self._index_rows_stamp:
+                # Устаревший снимок перестраивается полной загрузкой, она не должна идти одновременно с _load
+                with self._lock:
+                    rows = backend.load_index()
+                self._index_rows = [(record_id, normalize(name), normalize(login)) for record_id, name, login in rows]
+                self._index_rows_stamp = stamp
+            return self._index_rows
+
+    @perf.timed("storage.rank")
+    def rank(self, query: str, k: int) -> list[Record]:
+        with self._lock:
+            self._load()
+            self._ensure_index()
+            ids = self._index.rank(query, k, lambda record_id: self._records[record_id].use_stamp)
+            return [self._records[record_id] for record_id in ids]
+
+    def set_records(self, records: list[Record]) -> Future:
+        future = Future()
+        with self._lock:
+            self._load()
+            self._set_records(records)
+            self._pending.clear()
+            self._pending_save = True
+            self._waiters.append(future)
+        self._flusher.trigger()
+        return future
+
+    @perf.timed("storage.add_record")
+    def add_record(self, record: Record) -> Future:
+        self._encrypt_password(record, self.get_settings())
+        return self._commit("add", record)
+
+    @perf.timed("storage.add_records")
+    def add_records(self, records: list[Record]) -> Future:
+        # Массовое добавление. Все записи сохраняются одной записью файла, порядок перестраивается один раз
+        future = Future()
+        with self._lock:
+            self._load()
+            for record in records:
+                self._encrypt_password(record, self._settings)
+                self._records[record.id] = record
+                if self._index_ready:
+                    self._index.add(record.id, record.name, record.login)
+                # Записи добавляются отдельными изменениями, чтобы их можно было применить поверх файла,
+                # измененного снаружи. Записываются они все равно одним разом
+                if not self._pending_save:
+                    self._pending.append({"op": "add", "record": record.to_dict()})
+            self._order.build((r.id, self._order_key(r)) for r in self._records.values())
+            self._waiters.append(future)
+        self._flusher.trigger()
+        return future
+
+    @perf.timed("storage.delete_record")
+    def delete_record(self, record: Record) -> Future:
+        return self._commit("delete", record)
+
+    @perf.timed("storage.update_use_time")
+    def update_use_time(self, record: Record) -> Future:
+        record.use_stamp = int(time.time())
+        record.frecency = frecency_key(record.use_stamp, record.frecency)
+        return self._commit("touch", record)
+
+    def flush(self) -> None:
+        # Данные копируются под основной блокировкой, а пишутся на диск вне ее, чтобы чтения
+        # и новые изменения не ждали диска. Порядок записи сохраняет отдельная блокировка
+        with self._write_lock:
+            with self._lock:
+                if not (self._pending or self._pending_save):
+                    return
+                # Файл изменили снаружи после загрузки или его не удалось разобрать. Запись стерла бы правки,
+                # поэтому изменения остаются в памяти и записываются после перечитывания файла (reload)
+                stale = self._backend.stamp() != self._stamp
+                if stale:
+                    waiters, self._waiters = self._waiters, []
+                else:
+                    settings, records = self._settings, list(self._records.values())
+                    entries, save, waiters = self._pending, self._pending_save, self._waiters
+                    self._pending, self._pending_save, self._waiters = [], False, []
+                    self._writing = True
+            if stale:
+                error = Exception("The data file was changed outside the app, changes will be saved after it is reloaded")
+                for waiter in waiters:
+                    waiter.set_exception(error)
+                raise error
+            try:
+                with perf.span("storage.flush", records=len(records), changes=len(entries)):
+                    if save:
+                        self._backend.save(settings, records)
+                    else:
+                        self._backend.persist(settings, records, entries)
+            except Exception as e:
+                # Изменения остаются в памяти и будут записаны при следующей записи
+                with self._lock:
+                    if save:
+                        self._pending.clear()
+                        self._pending_save = True
+                    elif not self._pending_save:
+                        self._pending[:0] = entries
+                    self._writing = False
+                for waiter in waiters:
+                    waiter.set_exception(e)
+                raise
+            with self._lock:
+                self._writing = False
+                self._stamp = self._backend.stamp()
+        for waiter in waiters:
+            waiter.set_result(None)
+
+    def unload(self) -> None:
+        # Освобождает записи, индекс и порядок. При следующем обращении данные загрузятся заново.
+        # Хранилище с незаписанными изменениями остается загруженным
+        self._flusher.stop()
+        with self._write_lock:
+            self.flush()
+            with self._lock:
+                if self._stamp is None or self._pending or self._pending_save:
+                    return
+                self._set_records([])
+                self._settings = None
+                self._settings_stamp = None
+                self._stamp = None
+
+    def close(self) -> None:
+        # Записывает изменения и останавливает фоновые потоки: отложенную запись и наблюдатель за файлом
+        self._flusher.stop()
+        with self._lock:
+            watcher, self._watcher = self._watcher, None
+        if watcher is not None:
+            watcher.stop()
+        self.flush()
+
+    def sync_file(self) -> None:
+        with self._write_lock:
+            self.flush()
+            with self._lock:
+                self._load()
+                if self._backend.stamp() != self._stamp:
+                    raise Exception("The data file was changed outside the app and is not reloaded yet")
+                self._backend.sync_file(self._settings, list(self._records.values()))
+                self._stamp = self._backend.stamp()
+
+    def watch(self) -> None:
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._get_backend()
+            self._watcher = FileWatcher(self.file_path, self._on_file_modified, watch_delay)
+            self._watcher.start()
+
+    def subscribe(self, listener: Callable[[FileChange], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[FileChange], None]) -> None:
+        # Наблюдатель за файлом работает, пока хранилище открыто хотя бы в одном сеансе
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+            watcher = None
+            if not self._listeners:
+                watcher, self._watcher = self._watcher, None
+        if watcher is not None:
+            watcher.stop()
+
+    @perf.timed("storage.reload")
+    def reload(self) -> Optional[FileChange]:
+        # Перечитывает файл данных, если он изменился, и обновляет только отличающиеся записи.
+        # Возвращает None, если менять нечего
+        with self._write_lock, self._lock:
+            if self._stamp is None:
+                return None
+            stamp = self._backend.stamp()
+            if stamp == self._stamp:
+                self.flush()
+                return None
+            # Об ошибке в одной и той же версии файла сообщается один раз
+            if stamp == self._broken_stamp:
+                return None
+            try:
+                settings, records = self._backend.load()
+            except Exception:
+                self._broken_stamp = stamp
+                raise
+            if self._pending_save:
+                # Полная перезапись (set_records, шифрование) заменяет файл целиком, правки снаружи не переносятся
+                self._stamp = self._backend.stamp()
+                self._flusher.trigger()
+                return FileChange(error="The data file was changed during a full rewrite and will be overwritten")
+            # Незаписанные изменения применяются поверх новой версии файла и записываются в нее
+            index = {r.id: r for r in records}
+            for entry in self._pending:
+                apply_change(index, entry["op"], Record.from_dict(entry["record"]))
+            change = self._merge_records(list(index.values()))
+            self._settings = settings
+            self._stamp = self._backend.stamp()
+            if self._pending:
+                self._flusher.trigger()
+            return change
+
+    def _on_file_modified(self) -> None:
+        try:
+            change = self.reload()
+        except Exception as e:
+            logger.exception("Failed to reload the data file")
+            change = FileChange(error=str(e))
+        if change is None:
+            return
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(change)
+
+    def _merge_records(self, records: list[Record]) -> FileChange:
+        old = self._records
+        new = {r.id: r for r in records}
+        change = FileChange(
+            added=[rid for rid in new if rid not in old],
+            removed=[rid for rid in old if rid not in new],
+            changed=[rid for rid in new if rid in old and new[rid].to_dict() != old[rid].to_dict()]
+        )
+        self._records = new
+        for rid in change.removed:
+            self._order.remove(rid)
+        for rid in change.added + change.changed:
+            self._order.set(rid, self._order_key(new[rid]))
+        if self._index_ready:
+            for rid in change.removed + change.changed:
+                self._index.remove(rid)
+            for rid in change.added + change.changed:
+                self._index.add(rid, new[rid].name, new[rid].login)
+        return change
+
+    def _encrypt_vault(self, pin: str) -> None:
+        with self._lock:
+            self._load()
+            settings = self._settings
+            settings.salt = new_salt()
+            cipher = PasswordCipher(derive_key(pin, settings.salt))
+            with perf.span("storage.encrypt_vault", records=len(self._records)):
+                for r in self._records.values():
+                    if not is_encrypted(r.password):
+                        r.password = cipher.encrypt(r.password, r.id)
+            settings.check = cipher.make_check()
+            settings.pin = ""
+            self._cipher = cipher
+            self._pending.clear()
+            self._pending_save = True
+        # Открытые пароли сразу убираются со всех файлов на диске, включая выгрузку data.yml
+        self.sync_file()
+        with self._write_lock:
+            self._backend.purge()
+
+    def _encrypt_password(self, record: Record, settings: Settings) -> None:
+        # Без ключа пароль в зашифрованное хранилище не добавляется, иначе он попал бы на диск открытым
+        if self._cipher is None:
+            if settings.encrypted:
+                raise Exception("The vault is locked")
+            return
+        if not is_encrypted(record.password):
+            record.password = self._cipher.encrypt(record.password, record.id)
+
+    def _open_backend(self) -> Backend:
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+        if self.backend_name == "sqlite":
+            return SQLiteBackend(self.db_path, self.file_path)
+        return YAMLBackend(
+            self.file_path,
+            self.snapshot_path,
+            self.journal_path if self.use_journal else None
+        )
+
+    def _get_backend(self) -> Backend:
+        with self._backend_lock:
+            if self._backend is None:
+                self._backend = self._open_backend()
+            return self._backend
+
+    def _load(self) -> None:
+        self._get_backend()
+        # Пока есть незаписанные изменения, данные в памяти новее файла
+        if self._pending or self._pending_save or self._writing:
+            return
+        if self._watcher is not None and self._watcher.running and self._stamp is not None:
+            return
+        now = time.monotonic()
+        if self._stamp is not None and now - self._checked_at < reload_interval:
+            return
+        self._checked_at = now
+        stamp = self._backend.stamp()
+        if stamp == self._stamp:
+            return
+        with perf.span("storage.load") as span:
+            self._settings, records = self._backend.load()
+            self._set_records(records)
+            if span:
+                span.set(records=len(records))
+        self._stamp = self._backend.stamp()
+        # Загруженное хранилище ищется по своему индексу
+        self._index_rows, self._index_rows_stamp = [], None
+
+    def _set_records(self, records: list[Record]) -> None:
+        self._records = {r.id: r for r in records}
+        self._order.build((r.id, self._order_key(r)) for r in records)
+        self._index.clear()
+        self._index_ready = False
+
+    def _order_key(self, record: Record) -> float:
+        if self.order_by == "frecency":
+            return record.frecency
+        return record.use_stamp
+
+    def _ensure_index(self) -> None:
+        if self._index_ready:
+            return
+        with perf.span("storage.build_index", records=len(self._records)):
+            for r in self._records.values():
+                self._index.add(r.id, r.name, r.login)
+        self._index_ready = True
+
+    def _commit(self, op: str, record: Record) -> Future:
+        future = Future()
+        with self._lock:
+            self._load()
+            apply_change(self._records, op, record)
+            if record.id not in self._records:
+                self._order.remove(record.id)
+            else:
+                self._order.set(record.id, self._order_key(self._records[record.id]))
+            if self._index_ready and op == "add":
+                self._index.add(record.id, record.name, record.login)
+            elif self._index_ready and op == "delete":
+                self._index.remove(record.id)
+            if not self._pending_save:
+                self._pending.append({"op": op, "record": record.to_dict()})
+            self._waiters.append(future)
+        self._flusher.trigger()
+        return future
+
+
+# Именованные хранилища. Основное лежит в папке приложения, остальные - в подпапках vaults/<имя>.
+# Хранилище открывается при первом обращении, записи в памяти держат только vault_cache_size
+# последних использованных хранилищ
+class Vaults:
+
+    def __init__(self, default: Storage) -> None:
+        self._default = default
+        self._vaults: OrderedDict[str, Storage] = OrderedDict([(DEFAULT_VAULT, default)])
+        self._lock = threading.Lock()
+
+    @property
+    def dir_path(self) -> Path:
+        return self._default.dir_path / "vaults"
+
+    def names(self) -> list[str]:
+        names = [p.name for p in self.dir_path.iterdir() if p.is_dir()] if self.dir_path.exists() else []
+        return [DEFAULT_VAULT] + sorted(name for name in names if name != DEFAULT_VAULT and VAULT_NAME.fullmatch(name))
 
-    def add_record(self, record: Record):
-        self.set_records(self.get_records() + [record])
+    def get(self, name: str) -> Storage:
+        with self._lock:
+            vault = self._get_vault(name)
+            self._vaults.move_to_end(name)
+            loaded = [v for v in self._vaults.values() if v.loaded and v is not vault]
+        # Место под запрошенное хранилище оставляется, даже если оно еще не загружено
+        for old in loaded[:max(0, len(loaded) - vault_cache_size + 1)]:
+            old.unload()
+        return vault
 
-    def delete_record(self, record: Record):
-        records = self.get_records()
-        records.remove(record)
-        self.set_records(records)
+    @perf.timed("vaults.search")
+    def search(self, filter_string: str, exclude: Optional[str] = None) -> dict[str, list[str]]:
+        # id найденных записей по хранилищам. Незагруженные хранилища не загружаются и не вытесняют другие
+        result = {}
+        for name in self.names():
+            if name == exclude:
+                continue
+            with self._lock:
+                vault = self._get_vault(name)
+            ids = vault.find(filter_string)
+            if ids:
+                result[name] = ids
+        return result
 
-    def update_use_time(self, record: Record):
-        records = self.get_records()
-        idx = records.index(record)
-        record.use_time = datetime.now()
-        records[idx] = record
-        self.set_records(records)
+    def _get_vault(self, name: str) -> Storage:
+        if not VAULT_NAME.fullmatch(name):
+            raise ValueError(f"Invalid vault name: {name!r}")
+        vault = self._vaults.get(name)
+        if vault is None:
+            # Остальные хранилища настроены так же, как основное
+            vault = self._vaults[name] = type(self._default)(self.dir_path / name)
+        return vault
 
 
+# Общее хранилище процесса. В веб-режиме все сеансы читают и меняют одни и те же данные в памяти
 storage = Storage()
+vaults = Vaults(storage)
@@ -0,0 +1,264 @@
+# Импорт записей из CSV и JSON (выгрузки браузеров и менеджеров паролей) и экспорт в эти форматы.
+# Файлы читаются и пишутся по одной записи, импортированные записи сохраняются одной записью хранилища.
+#
+#   python transfer.py import chrome_passwords.csv
+#   python transfer.py import bitwarden_export.json
+#   python transfer.py export backup.csv
+#   python transfer.py import work.csv --vault work
+from __future__ import annotations
+
+import argparse
+import csv
+import getpass
+import json
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional, TextIO
+from urllib.parse import urlparse
+
+from search import normalize
+from storage import Storage, Record, VAULT_NAME
+from utils import to_stamp, stamp_to_str
+
+
+# Названия полей в выгрузках Chrome, Firefox, Bitwarden, KeePass, 1Password и в собственном формате.
+# Сравниваются без учета регистра
+NAME_FIELDS = ("name", "title", "account")
+LOGIN_FIELDS = ("login", "username", "login_username", "login name", "user name", "email")
+PASSWORD_FIELDS = ("password", "login_password")
+URL_FIELDS = ("url", "login_uri", "web site", "website", "uri")
+TIME_FIELDS = ("use_time", "timelastused")
+EXPORT_FIELDS = ("name", "login", "password", "use_time")
+
+# Ключи с массивом записей, если корень JSON-документа - объект (Bitwarden: "items")
+JSON_ARRAY_KEYS = ("items", "records")
+
+
+@dataclass
+class ImportResult:
+    added: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+
+
+def read_csv(file: TextIO) -> Iterator[dict]:
+    for row in csv.DictReader(file):
+        yield {(key or "").strip().lower(): value for key, value in row.items()}
+
+
+def read_json(file: TextIO, chunk_size: int = 64 * 1024) -> Iterator[dict]:
+    # Корень документа - массив записей или объект с массивом "items"/"records".
+    # Документ читается частями, записи разбираются по одной
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+
+    def fill() -> bool:
+        nonlocal buffer, pos
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return False
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    def peek() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return buffer[pos:pos + 1]
+
+    def decode():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # Число на границе части могло быть прочитано не полностью
+            if end < len(buffer) or not fill():
+                pos = end
+                return value
+
+    first = peek()
+    if first == "{":
+        # Ключи ищутся только на верхнем уровне объекта, значения остальных ключей пропускаются
+        pos += 1
+        while True:
+            char = peek()
+            if char in ("}", ""):
+                raise ValueError("JSON object has no \"items\" or \"records\" array")
+            if char == ",":
+                pos += 1
+                continue
+            key = decode()
+            if not isinstance(key, str) or peek() != ":":
+                raise ValueError("Invalid JSON object")
+            pos += 1
+            if key in JSON_ARRAY_KEYS and peek() == "[":
+                pos += 1
+                break
+            decode()
+    elif first == "[":
+        pos += 1
+    else:
+        raise ValueError("JSON document must be an array or an object")
+
+    while True:
+        char = peek()
+        if char in ("]", ""):
+            return
+        if char == ",":
+            pos += 1
+            continue
+        item = decode()
+        if isinstance(item, dict):
+            yield {str(key).lower(): value for key, value in item.items()}
+
+
+def to_record(item: dict) -> Optional[Record]:
+    # Возвращает None, если в записи нет имени (или адреса сайта) либо пароля
+    login = item.get("login")
+    if isinstance(login, dict):
+        # Bitwarden JSON: логин, пароль и адреса вложены в "login"
+        uris = login.get("uris") or [{}]
+        item = {**item, "login": login.get("username"), "password": login.get("password"), "url": uris[0].get("uri")}
+    password = pick(item, PASSWORD_FIELDS)
+    url = pick(item, URL_FIELDS)
+    name = pick(item, NAME_FIELDS) or (urlparse(url).hostname if url else None)
+    if not name or not password:
+        return None
+    return Record(
+        name=name,
+        login=pick(item, LOGIN_FIELDS) or "",
+        password=password,
+        use_stamp=parse_time(pick(item, TIME_FIELDS))
+    )
+
+
+def pick(item: dict, fields: tuple[str, ...]) -> Optional[str]:
+    for key in fields:
+        value = item.get(key)
+        if value not in (None, ""):
+            return str(value).strip()
+    return None
+
+
+def parse_time(value: Optional[str]) -> int:
+    # Собственный формат, ISO 8601 или время Unix (Firefox пишет его в миллисекундах)
+    if not value:
+        return int(time.time())
+    if value.isdigit():
+        timestamp = int(value)
+        return timestamp // 1000 if timestamp > 10 ** 11 else timestamp
+    try:
+        return to_stamp(value)
+    except ValueError:
+        return int(time.time())
+
+
+def detect_format(path: Path, fmt: Optional[str]) -> str:
+    fmt = fmt or path.suffix.lstrip(".").lower()
+    if fmt not in ("csv", "json"):
+        raise ValueError(f"Unknown format of {path}, use --format csv or --format json")
+    return fmt
+
+
+def import_records(storage: Storage, path: Path, fmt: Optional[str] = None) -> ImportResult:
+    # Дубликатом считается запись с тем же именем и логином без учета регистра - как среди имеющихся записей,
+    # так и внутри файла
+    reader = read_csv if detect_format(path, fmt) == "csv" else read_json
+    result = ImportResult()
+    seen = {(normalize(r.name), normalize(r.login)) for r in storage.get_records()}
+    records = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as file:
+        for item in reader(file):
+            record = to_record(item)
+            if record is None:
+                result.invalid += 1
+                continue
+            key = (normalize(record.name), normalize(record.login))
+            if key in seen:
+                result.duplicates += 1
+                continue
+            seen.add(key)
+            records.append(record)
+    if records:
+        future = storage.add_records(records)
+        storage.flush()
+        future.result()
+    result.added = len(records)
+    return result
+
+
+def export_records(storage: Storage, path: Path, fmt: Optional[str] = None) -> int:
+    # Пароли выгружаются открытыми. Зашифрованное хранилище должно быть разблокировано
+    fmt = detect_format(path, fmt)
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        if fmt == "csv":
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_FIELDS)
+        else:
+            file.write("[")
+        for record in storage.get_records():
+            row = export_row(storage, record)
+            if fmt == "csv":
+                writer.writerow([row[key] for key in EXPORT_FIELDS])
+            else:
+                file.write(("," if count else "") + "\n  " + json.dumps(row, ensure_ascii=False))
+            count += 1
+        if fmt == "json":
+            file.write("\n]\n")
+    return count
+
+
+def export_row(storage: Storage, record: Record) -> dict:
+    return {
+        "name": record.name,
+        "login": record.login,
+        "password": storage.reveal_password(record),
+        "use_time": stamp_to_str(record.use_stamp)
+    }
+
+
+def vault_name(value: str) -> str:
+    if not VAULT_NAME.fullmatch(value):
+        raise argparse.ArgumentTypeError(f"invalid vault name {value!r}, use letters, digits, \"_\" and \"-\"")
+    return value
+
+
+def main() -> int:
+    from storage import vaults, DEFAULT_VAULT
+
+    parser = argparse.ArgumentParser(description="Amnesia import and export")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=["csv", "json"], help="by default taken from the file extension")
+    parser.add_argument("--vault", type=vault_name, default=DEFAULT_VAULT, help="vault name, created if it does not exist")
+    args = parser.parse_args()
+
+    storage = vaults.get(args.vault)
+
+    if storage.get_settings().encrypted and not storage.unlock(getpass.getpass("PIN: ")):
+        print("Wrong PIN", file=sys.stderr)
+        return 1
+
+    if args.command == "import":
+        result = import_records(storage, args.path, args.format)
+        print(f"Added: {result.added}, duplicates: {result.duplicates}, invalid: {result.invalid}")
+    else:
+        count = export_records(storage, args.path, args.format)
+        print(f"Exported: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
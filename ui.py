@@ -2,18 +2,31 @@ from __future__ import annotations
 
 import copy
 import os
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import Future
+from dataclasses import dataclass
 from enum import Enum, auto
 from typing import Optional, Callable
 
 import flet as ft
-import pyperclip
 
-from storage import storage, Record
+import perf
+from clipboard import clipboard
+from search import matches
+from storage import vaults, Storage, Record, FileChange, DEFAULT_VAULT
+from utils import Debouncer
 
 
 FONT_FAMILY = "Consolas"
+# Сколько лучших записей показывать при нечетком поиске
+RANKED_LIMIT = 50
+# Карточки списка создаются порциями по мере прокрутки
+CARDS_PAGE_SIZE = 30
+# За сколько пикселей до конца списка подгружается следующая порция
+CARDS_SCROLL_THRESHOLD = 600
+# Пауза после ввода в поле фильтра, после которой выполняется поиск
+FILTER_DELAY = 0.15
 
 
 class UnlockPage(ft.UserControl):
@@ -25,6 +38,8 @@ class UnlockPage(ft.UserControl):
         self._field_2: ft.TextField = ...
         self._field_3: ft.TextField = ...
         self._field_4: ft.TextField = ...
+        # Зашифрованное хранилище открывается парольной фразой произвольной длины
+        self._passphrase: ft.TextField = ...
 
     @property
     def fields(self) -> list[ft.TextField]:
@@ -76,6 +91,23 @@ class UnlockPage(ft.UserControl):
         self._field_3 = copy.deepcopy(self._field_1)
         self._field_4 = copy.deepcopy(self._field_1)
         self._field_1.autofocus = True
+        self._passphrase = ft.TextField(
+            width=340,
+            focused_border_color="0xff9ecaff",
+            cursor_color="0xff9ecaff",
+            text_style=ft.TextStyle(
+                color="0xff9ecaff",
+                font_family=FONT_FAMILY,
+                size=20
+            ),
+            border=ft.InputBorder.UNDERLINE,
+            border_width=5,
+            border_color="0xff9ecaff",
+            bgcolor="0xff202429",
+            password=True,
+            visible=False,
+            on_submit=lambda e: self.cb_unlock(self._passphrase.value or "")
+        )
 
         return ft.Column(
             controls=[
@@ -88,15 +120,25 @@ class UnlockPage(ft.UserControl):
                     ],
                     alignment=ft.MainAxisAlignment.SPACE_EVENLY
                 ),
+                self._passphrase
             ],
             horizontal_alignment=ft.CrossAxisAlignment.CENTER,
             animate_opacity=ft.animation.Animation(duration=100)
         )
 
+    def set_passphrase_mode(self, enabled: bool) -> None:
+        self.controls[0].controls[0].visible = not enabled
+        self._passphrase.visible = enabled
+        self.reset()
+
     def reset(self) -> None:
         for field in self.fields:
             field.value = ""
-        self._field_1.focus()
+        self._passphrase.value = ""
+        if self._passphrase.visible:
+            self._passphrase.focus()
+        else:
+            self._field_1.focus()
         self.update()
 
 
@@ -110,18 +152,23 @@ class RecordCard(ft.UserControl):
         SELECTED_LOGIN = auto()
         SELECTED_PASSWORD = auto()
 
-    def __init__(self, record: Record, cb_click: Callable):
+    def __init__(self, record_id: str, storage: Storage, cb_click: Callable):
         super(RecordCard, self).__init__()
-        self._record = record
+        self._record_id = record_id
+        self._storage = storage
         self._text_1: ft.Text = ...
         self._text_2: ft.Text = ...
         self._container: ft.Container = ...
-        self._state: RecordCard.State = ...
+        self._state = self.State.DEFAULT
         self.cb_click = cb_click
 
+    @property
+    def record_id(self) -> str:
+        return self._record_id
+
     @property
     def record(self) -> Record:
-        return self._record
+        return self._storage.get_record(self._record_id)
 
     @property
     def state(self) -> RecordCard.State:
@@ -129,14 +176,14 @@ class RecordCard(ft.UserControl):
 
     def build(self) -> ft.Container:
         self._text_1 = ft.Text(
-            value=self._record.name,
+            value=self.record.name,
             text_align=ft.TextAlign.CENTER,
             size=18,
             font_family=FONT_FAMILY,
             color="black",
         )
         self._text_2 = ft.Text(
-            value=self._record.login,
+            value=self.record.login,
             text_align=ft.TextAlign.CENTER,
             size=18,
             font_family=FONT_FAMILY,
@@ -160,23 +207,29 @@ class RecordCard(ft.UserControl):
             on_click=self._on_click,
             opacity=0.7
         )
+        # Карточка может быть убрана из списка и добавлена снова, тогда она строится заново в текущем состоянии
+        self._apply_state(self._state)
         return self._container
 
     def set_state(self, state: RecordCard.State) -> None:
+        self._apply_state(state)
+        self.update()
+
+    def _apply_state(self, state: RecordCard.State) -> None:
+        record = self.record
         if state == self.State.DEFAULT:
-            self._text_1.value = self._record.name
-            self._text_2.value = self._record.login
+            self._text_1.value = record.name
+            self._text_2.value = record.login
             self._container.gradient.colors = self.gradient_1
         elif state == self.State.SELECTED_LOGIN:
-            self._text_1.value = self._record.name
-            self._text_2.value = self._record.login
+            self._text_1.value = record.name
+            self._text_2.value = record.login
             self._container.gradient.colors = self.gradient_2
         elif state == self.State.SELECTED_PASSWORD:
-            self._text_1.value = self._record.name
-            self._text_2.value = self._record.password
+            self._text_1.value = record.name
+            self._text_2.value = self._storage.reveal_password(record)
             self._container.gradient.colors = self.gradient_2
         self._state = state
-        self.update()
 
     def _on_click(self, e: ft.ControlEvent):
         self.cb_click(self)
@@ -184,53 +237,160 @@ class RecordCard(ft.UserControl):
 
 class RecordListPage(ft.UserControl):
 
-    def __init__(self) -> None:
+    def __init__(self, storage: Storage, cb_record_use: Callable) -> None:
         super(RecordListPage, self).__init__()
+        self.cb_record_use = cb_record_use
+        self._storage = storage
         self.filter_string = ""
+        self.fuzzy = False
         self._selected_card = None
+        # id записей текущей выборки по порядку, карточки уже созданных записей и число показанных карточек.
+        # При обновлении списка существующие карточки переиспользуются, создаются только недостающие
+        self._record_ids: list[str] = []
+        self._cards: dict[str, RecordCard] = {}
+        self._shown = CARDS_PAGE_SIZE
 
     @property
     def selected_card(self) -> Optional[RecordCard]:
         return self._selected_card
 
     def build(self) -> ft.Column:
+        # Список заполняется после ввода пин-кода, чтобы экран разблокировки не ждал загрузки данных
         return ft.Column(
-            controls=self._build_cards(),
+            controls=[],
             scroll=ft.ScrollMode.AUTO,
+            on_scroll=self._on_scroll,
+            on_scroll_interval=100,
             animate_opacity=ft.animation.Animation(duration=100),
             height=480
         )
 
+    @staticmethod
+    def find(storage: Storage, filter_string: str, fuzzy: bool) -> list[str]:
+        if fuzzy and filter_string:
+            records = storage.rank(filter_string, RANKED_LIMIT)
+        else:
+            records = storage.search(filter_string)
+        return [record.id for record in records]
+
+    def set_storage(self, storage: Storage) -> None:
+        # Карточки и выделение относятся к записям прежнего хранилища. Список строится заново при reset
+        self._storage = storage
+        self._cards.clear()
+        self._record_ids = []
+        self._selected_card = None
+
+    @perf.timed("ui.RecordListPage.reset")
     def reset(self) -> None:
+        self._shown = CARDS_PAGE_SIZE
         self.controls[0].controls = self._build_cards()
         self.update()
 
+    @perf.timed("ui.RecordListPage.show_results")
+    def show_results(self, filter_string: str, fuzzy: bool, record_ids: list[str]) -> None:
+        self.filter_string = filter_string
+        self.fuzzy = fuzzy
+        self._record_ids = record_ids
+        self._shown = CARDS_PAGE_SIZE
+        self._show_cards()
+
+    def insert_record(self, record_id: str) -> None:
+        record = self._storage.get_record(record_id)
+        if record is None or record_id in self._record_ids:
+            return
+        if self.fuzzy and self.filter_string:
+            # Место записи в нечеткой выдаче зависит от остальных записей
+            self.reset()
+            return
+        if not matches(self.filter_string, record.name, record.login):
+            return
+        self._record_ids.insert(self._position(record_id), record_id)
+        self._show_cards()
+
+    def remove_record(self, record_id: str) -> None:
+        self._cards.pop(record_id, None)
+        if record_id not in self._record_ids:
+            return
+        self._record_ids.remove(record_id)
+        self._show_cards()
+
+    def refresh_record(self, record_id: str) -> None:
+        card = self._cards.get(record_id)
+        if card is not None and record_id in self._record_ids[:self._shown]:
+            card.set_state(card.state)
+
+    def move_to_front(self, record_id: str) -> None:
+        # При порядке по frecency использованная запись не обязательно становится первой
+        if (self.fuzzy and self.filter_string) or (record_id not in self._record_ids):
+            return
+        self._record_ids.remove(record_id)
+        self._record_ids.insert(self._position(record_id), record_id)
+        self._show_cards()
+
+    def _position(self, record_id: str) -> int:
+        # Место записи в выборке, упорядоченной как в хранилище. Добавленная снаружи запись
+        # со старым временем использования попадает не в начало списка
+        item = self._storage.order_item(record_id)
+        low, high = 0, len(self._record_ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self._storage.order_item(self._record_ids[middle]) > item:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @perf.timed("ui.RecordListPage._build_cards")
     def _build_cards(self) -> list[RecordCard]:
-        records = storage.get_records()
-        if self.filter_string:
-            records = [
-                rec for rec in records
-                if (self.filter_string.lower() in rec.name.lower())
-                or (self.filter_string.lower() in rec.login.lower())
-            ]
-        return [
-            RecordCard(
-                record=record,
+        # Карточки создаются только для первой порции записей, остальные - при прокрутке
+        self._record_ids = self.find(self._storage, self.filter_string, self.fuzzy)
+        for record_id in [rid for rid in self._cards if self._storage.get_record(rid) is None]:
+            del self._cards[record_id]
+        return self._visible_cards()
+
+    def _visible_cards(self) -> list[RecordCard]:
+        visible_ids = self._record_ids[:self._shown]
+        if self._selected_card is not None and self._selected_card.record_id not in visible_ids:
+            # Выделение снимается, если карточка больше не видна
+            self._cards.pop(self._selected_card.record_id, None)
+            self._selected_card = None
+        return [self._get_card(record_id) for record_id in visible_ids]
+
+    def _get_card(self, record_id: str) -> RecordCard:
+        card = self._cards.get(record_id)
+        if card is None:
+            card = RecordCard(
+                record_id=record_id,
+                storage=self._storage,
                 cb_click=self._on_card_click
             )
-            for record in records
-        ]
+            self._cards[record_id] = card
+        return card
 
-    def _on_card_click(self, card: RecordCard):
+    def _show_cards(self) -> None:
+        self.controls[0].controls = self._visible_cards()
+        self.update()
+
+    def _on_scroll(self, e: ft.OnScrollEvent):
+        if e.pixels < e.max_scroll_extent - CARDS_SCROLL_THRESHOLD:
+            return
+        if self._shown >= len(self._record_ids):
+            return
+        self._shown += CARDS_PAGE_SIZE
+        self._show_cards()
 
+    @perf.timed("ui.RecordListPage._on_card_click")
+    def _on_card_click(self, card: RecordCard):
+        # Карточка меняется сразу, буфер обмена - в фоне
         if card is self._selected_card:
             if card.state == RecordCard.State.SELECTED_LOGIN:
                 card.set_state(RecordCard.State.SELECTED_PASSWORD)
-                pyperclip.copy(card.record.password)
-                storage.update_use_time(card.record)
+                clipboard.copy(self._storage.reveal_password(card.record), secret=True)
+                future = self._storage.update_use_time(card.record)
+                self.cb_record_use(card.record_id, future)
             elif card.state == RecordCard.State.SELECTED_PASSWORD:
                 card.set_state(RecordCard.State.DEFAULT)
-                pyperclip.copy("")
+                clipboard.clear()
                 self._selected_card = None
             return
 
@@ -239,15 +399,29 @@ class RecordListPage(ft.UserControl):
             self._selected_card = None
 
         card.set_state(RecordCard.State.SELECTED_LOGIN)
-        pyperclip.copy(card.record.login)
+        clipboard.copy(card.record.login)
         self._selected_card = card
 
 
 class SearchPage(ft.UserControl):
 
-    def __init__(self, cb_search_click: Callable) -> None:
+    def __init__(self,
+                 storage: Storage,
+                 cb_search_click: Callable,
+                 cb_filter_change: Callable,
+                 cb_vault_change: Callable
+                 ) -> None:
+
         super(SearchPage, self).__init__()
         self.cb_search_click = cb_search_click
+        self.cb_filter_change = cb_filter_change
+        self.cb_vault_change = cb_vault_change
+        self._storage = storage
+        self._vault_name = DEFAULT_VAULT
+        # Поиск выполняется в фоне после паузы во вводе. Результат устаревшего запроса отбрасывается
+        self._filter = Debouncer(self._run_filter, FILTER_DELAY)
+        self._generation = 0
+        self._lock = threading.Lock()
 
     def build(self) -> ft.Column:
         return ft.Column(
@@ -259,27 +433,89 @@ class SearchPage(ft.UserControl):
                     cursor_color="black",
                     label_style=ft.TextStyle(color="black"),
                     text_style=ft.TextStyle(color="black"),
-                    autofocus=True
+                    autofocus=True,
+                    on_change=self._on_filter_change
+                ),
+                ft.Checkbox(
+                    label="Fuzzy",
+                    value=False,
+                    fill_color="black",
+                    check_color="0xffc1c4ca",
+                    label_style=ft.TextStyle(color="black"),
+                    on_change=self._on_filter_change
                 ),
-                ft.ProgressBar(width=340, value=0),
                 ft.ElevatedButton(
                     text="Search",
                     width=340,
                     on_click=self._on_btn_search_click
+                ),
+                # Сколько записей нашлось в остальных хранилищах
+                ft.Text(
+                    value="",
+                    color="black",
+                    font_family=FONT_FAMILY
+                ),
+                ft.Dropdown(
+                    label="Vault",
+                    color="black",
+                    focused_border_color="black",
+                    label_style=ft.TextStyle(color="black"),
+                    text_style=ft.TextStyle(color="black"),
+                    options=[ft.dropdown.Option(DEFAULT_VAULT)],
+                    value=DEFAULT_VAULT,
+                    on_change=self._on_vault_change
                 )
             ],
             horizontal_alignment=ft.CrossAxisAlignment.CENTER,
             animate_opacity=ft.animation.Animation(duration=100)
         )
 
-    def _on_btn_search_click(self, e: ft.ControlEvent):
+    def show_vaults(self, names: list[str]) -> None:
+        dropdown = self.controls[0].controls[4]
+        dropdown.options = [ft.dropdown.Option(name) for name in names]
+        dropdown.value = self._vault_name
+        dropdown.update()
+
+    def set_vault(self, name: str, storage: Storage) -> None:
+        # Поиск, начатый в прежнем хранилище, отбрасывается
+        with self._lock:
+            self._generation += 1
+            self._vault_name = name
+            self._storage = storage
+
+    def close(self) -> None:
+        self._filter.stop()
+
+    def _on_vault_change(self, e: ft.ControlEvent):
+        self.cb_vault_change(e.control.value)
+
+    def _on_filter_change(self, e: ft.ControlEvent):
         text_field = self.controls[0].controls[0]
-        progress_bar = self.controls[0].controls[1]
-        for i in range(1, 51):
-            progress_bar.value = 0.02 * i
-            time.sleep(0.01)
-            self.update()
-        self.cb_search_click(text_field.value)
+        checkbox = self.controls[0].controls[1]
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        self._filter.trigger(text_field.value or "", checkbox.value, generation)
+
+    def _on_btn_search_click(self, e: ft.ControlEvent):
+        # Если поиск еще ждет паузы во вводе, он выполняется сразу
+        self._filter.flush()
+        self.cb_search_click()
+
+    def _run_filter(self, filter_string: str, fuzzy: bool, generation: int) -> None:
+        with self._lock:
+            storage, vault_name = self._storage, self._vault_name
+        record_ids = RecordListPage.find(storage, filter_string, fuzzy)
+        # Остальные хранилища ищутся по именам и логинам без загрузки, нечеткий поиск по ним не выполняется
+        found = vaults.search(filter_string, exclude=vault_name) if filter_string and not fuzzy else {}
+        with self._lock:
+            if generation != self._generation:
+                return
+        self.cb_filter_change(filter_string, fuzzy, record_ids)
+        counts = ", ".join(f"{name}: {len(ids)}" for name, ids in found.items())
+        hint = self.controls[0].controls[3]
+        hint.value = f"Also found in {counts}" if counts else ""
+        hint.update()
 
 
 class AddRecordPage(ft.UserControl):
@@ -340,7 +576,7 @@ class AddRecordPage(ft.UserControl):
             name=name,
             login=login,
             password=password,
-            use_time=datetime.now()
+            use_stamp=int(time.time())
         )
         self.cb_save_click(record)
 
@@ -581,16 +817,36 @@ class Lamp(ft.UserControl):
             self._set_state(self.State.OFF)
 
 
+# Изменение записи, о котором сеанс сообщает остальным сеансам веб-режима
+@dataclass
+class RecordChange:
+    vault: str
+    op: str
+    record_id: str
+
+
 class Device(ft.UserControl):
 
     def __init__(self, page: ft.Page) -> None:
         super(Device, self).__init__()
         self._page = page
         self._is_locked = True
+        # Текущее хранилище и хранилища, пин-код которых уже введен в этом сеансе
+        self._vault_name = DEFAULT_VAULT
+        self._storage = vaults.get(DEFAULT_VAULT)
+        self._unlocked_vaults: set[str] = set()
 
         self._unlock_page = UnlockPage(cb_unlock=self._on_unlock_click)
-        self._record_list_page = RecordListPage()
-        self._search_page = SearchPage(cb_search_click=self._on_search_click)
+        self._record_list_page = RecordListPage(
+            storage=self._storage,
+            cb_record_use=self._on_record_use
+        )
+        self._search_page = SearchPage(
+            storage=self._storage,
+            cb_search_click=self._on_search_click,
+            cb_filter_change=self._on_filter_change,
+            cb_vault_change=self._on_vault_change
+        )
         self._add_record_page = AddRecordPage(cb_save_click=self._on_save_click)
 
         self._screen = Screen(
@@ -624,48 +880,161 @@ class Device(ft.UserControl):
         )
 
     def setup(self) -> None:
+        self._unlock_page.set_passphrase_mode(self._storage.get_settings().encrypted)
         self._screen.show_unlock_page()
+        # Данные загружаются в фоне, пока пользователь вводит пин-код
+        threading.Thread(target=self._storage.preload, daemon=True).start()
+        # Изменения из других сеансов веб-режима приходят через pubsub и применяются к списку
+        self._page.pubsub.subscribe(self._on_record_change)
+        # Правки файла данных снаружи подхватываются наблюдателем за файлом
+        self._storage.watch()
+        self._storage.subscribe(self._on_file_change)
+        self._page.on_disconnect = self._on_disconnect
+
+    def _on_disconnect(self, e: ft.ControlEvent) -> None:
+        self._storage.unsubscribe(self._on_file_change)
+        self._search_page.close()
+
+    @perf.timed("ui.Device._on_file_change")
+    def _on_file_change(self, change: FileChange) -> None:
+        if change.error is not None:
+            self._show_message(f"Failed to read the data file: {change.error}")
+            self._lamp.blink_red()
+            return
+        if not self._is_locked:
+            for record_id in change.removed:
+                self._record_list_page.remove_record(record_id)
+            for record_id in change.added:
+                self._record_list_page.insert_record(record_id)
+            for record_id in change.changed:
+                self._record_list_page.refresh_record(record_id)
+        self._lamp.blink_green()
+
+    def _show_message(self, text: str) -> None:
+        self._page.snack_bar = ft.SnackBar(content=ft.Text(text))
+        self._page.snack_bar.open = True
+        self._page.update()
+
+    def _publish(self, op: str, record_id: str) -> None:
+        self._page.pubsub.send_others(RecordChange(vault=self._vault_name, op=op, record_id=record_id))
+
+    @perf.timed("ui.Device._on_record_change")
+    def _on_record_change(self, change: RecordChange) -> None:
+        # Данные уже изменены в общем хранилище, сеансу остается обновить список.
+        # Заблокированный сеанс построит список заново после ввода пин-кода
+        if self._is_locked or change.vault != self._vault_name:
+            return
+        if change.op == "add":
+            self._record_list_page.insert_record(change.record_id)
+        elif change.op == "delete":
+            self._record_list_page.remove_record(change.record_id)
+        elif change.op == "touch":
+            self._record_list_page.move_to_front(change.record_id)
+
+    def _on_record_use(self, record_id: str, future: Future) -> None:
+        # Другие сеансы получают уведомление, а свой список переупорядочивается сразу
+        self._record_list_page.move_to_front(record_id)
+        self._publish("touch", record_id)
+        future.add_done_callback(self._on_use_written)
+
+    def _on_use_written(self, future: Future) -> None:
+        # Об успешной записи времени использования не сообщается, чтобы светодиод не мигал на каждый клик
+        if future.exception() is not None:
+            self._on_write_done(future)
+
+    def _on_write_done(self, future: Future) -> None:
+        # Вызывается в потоке записи после того, как изменение записано на диск или запись не удалась
+        error = future.exception()
+        if error is None:
+            self._lamp.blink_green()
+            return
+        self._show_message(f"Failed to save changes: {error}")
+        self._lamp.blink_red()
 
+    @perf.timed("ui.Device._on_unlock_click")
     def _on_unlock_click(self, password: str) -> None:
-        settings = storage.get_settings()
-        if password == settings.pin:
+        if self._storage.unlock(password):
             self._is_locked = False
+            self._unlocked_vaults.add(self._vault_name)
             self._button_bar.enable()
+            self._record_list_page.reset()
             self._screen.show_record_list_page()
             self._lamp.blink_green()
         else:
             self._unlock_page.reset()
             self._lamp.blink_red()
 
+    @perf.timed("ui.Device._on_save_click")
     def _on_save_click(self, record: Record) -> None:
         if not record.name:
             self._lamp.blink_red()
             return
-        storage.add_record(record)
-        self._record_list_page.reset()
-        self._lamp.blink_green()
-
-    def _on_search_click(self, filter_string: str) -> None:
-        self._record_list_page.filter_string = filter_string
-        self._record_list_page.reset()
+        # Список обновляется сразу, а светодиод показывает результат записи на диск
+        future = self._storage.add_record(record)
+        self._record_list_page.insert_record(record.id)
+        self._publish("add", record.id)
+        future.add_done_callback(self._on_write_done)
+
+    @perf.timed("ui.Device._on_search_click")
+    def _on_search_click(self) -> None:
+        if self._is_locked:
+            self._screen.show_unlock_page()
+            return
         self._screen.show_record_list_page()
         self._lamp.blink_green()
 
+    @perf.timed("ui.Device._on_filter_change")
+    def _on_filter_change(self, filter_string: str, fuzzy: bool, record_ids: list[str]) -> None:
+        if self._is_locked:
+            return
+        self._record_list_page.show_results(filter_string, fuzzy, record_ids)
+
+    @perf.timed("ui.Device._on_vault_change")
+    def _on_vault_change(self, name: str) -> None:
+        if name == self._vault_name:
+            return
+        self._storage.unsubscribe(self._on_file_change)
+        # Хранилища сверх vault_cache_size освобождают записи, но остаются открытыми
+        self._vault_name = name
+        self._storage = vaults.get(name)
+        self._record_list_page.set_storage(self._storage)
+        self._search_page.set_vault(name, self._storage)
+        self._storage.watch()
+        self._storage.subscribe(self._on_file_change)
+        if name in self._unlocked_vaults:
+            self._is_locked = False
+            self._record_list_page.reset()
+            self._screen.show_record_list_page()
+            self._lamp.blink_green()
+            return
+        # У каждого хранилища свой пин-код. Данные загружаются в фоне, пока пользователь его вводит.
+        # Вернуться в другое хранилище можно со страницы поиска
+        self._is_locked = True
+        self._unlock_page.set_passphrase_mode(self._storage.get_settings().encrypted)
+        self._screen.show_unlock_page()
+        self._show_message(f"Enter the PIN of the \"{name}\" vault")
+        threading.Thread(target=self._storage.preload, daemon=True).start()
+
+    @perf.timed("ui.Device._on_list_click")
     def _on_list_click(self) -> None:
         if self._is_locked:
             return
         self._screen.show_record_list_page()
 
+    @perf.timed("ui.Device._on_add_click")
     def _on_add_click(self) -> None:
         if self._is_locked:
             return
         self._screen.show_add_record_page()
 
+    @perf.timed("ui.Device._on_filter_click")
     def _on_filter_click(self) -> None:
-        if self._is_locked:
+        if not self._unlocked_vaults:
             return
         self._screen.show_search_page()
+        self._search_page.show_vaults(vaults.names())
 
+    @perf.timed("ui.Device._on_delete_click")
     def _on_delete_click(self) -> None:
 
         if self._is_locked:
@@ -677,12 +1046,13 @@ class Device(ft.UserControl):
         record = self._record_list_page.selected_card.record
 
         def on_accept(e: ft.ControlEvent):
-            storage.delete_record(record)
+            future = self._storage.delete_record(record)
             dlg_modal.open = False
             self._page.update()
-            self._record_list_page.reset()
+            self._record_list_page.remove_record(record.id)
+            self._publish("delete", record.id)
             self._screen.show_record_list_page()
-            self._lamp.blink_green()
+            future.add_done_callback(self._on_write_done)
 
         def on_reject(e: ft.ControlEvent):
             dlg_modal.open = False
@@ -703,5 +1073,14 @@ class Device(ft.UserControl):
         dlg_modal.open = True
         self._page.update()
 
+    @perf.timed("ui.Device._on_file_click")
     def _on_file_click(self) -> None:
-        os.startfile(storage.file_path)
+        if self._is_locked:
+            return
+        try:
+            self._storage.sync_file()
+        except Exception as e:
+            self._show_message(f"Failed to prepare the data file: {e}")
+            self._lamp.blink_red()
+            return
+        os.startfile(self._storage.file_path)
@@ -1,19 +1,38 @@
+from __future__ import annotations
+
+import json
+import marshal
+import os
+import struct
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Optional, Callable
 
 import yaml
+from loguru import logger
+
+import perf
 
+# Если PyYAML собран с libyaml, используются его загрузчик и выгрузчик на C
+YAMLLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAMLDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 
-class DatetimeFormatter:
 
-    def __init__(self, fmt: str = "%Y-%m-%d %H:%M:%S"):
-        self.fmt = fmt
+# Время использования записи хранится как целое число секунд Unix (местное время при переводе в строку).
+# В data.yml и журнале оно записано строкой "%Y-%m-%d %H:%M:%S": datetime.fromisoformat разбирает ее
+# в несколько раз быстрее strptime. Значения, которые YAML сам прочитал как datetime, тоже принимаются
+def to_stamp(value) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
 
-    def dt_2_str(self, dt: datetime) -> str:
-        return dt.strftime(self.fmt)
 
-    def str_2_dt(self, date_str: str) -> datetime:
-        return datetime.strptime(date_str, self.fmt)
+def stamp_to_str(stamp: int) -> str:
+    return datetime.fromtimestamp(stamp).isoformat(sep=" ", timespec="seconds")
 
 
 class YAMLFile:
@@ -27,10 +46,268 @@ class YAMLFile:
     def path(self) -> Path:
         return self._path
 
+    def stamp(self) -> tuple[int, int]:
+        stat = self._path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
     def read(self) -> dict:
-        with open(self._path, "r") as file:
-            return yaml.safe_load(file)
+        with perf.span("yaml.read") as span, open(self._path, "r") as file:
+            data = yaml.load(file, Loader=YAMLLoader)
+            if span:
+                span.set(bytes_read=file.tell())
+            return data
 
     def write(self, data: dict) -> None:
-        with open(self._path, "w") as file:
-            yaml.safe_dump(data, file)
+        # Запись во временный файл с последующей подменой, чтобы при сбое не остался обрезанный файл
+        tmp_path = self._path.with_name(self._path.name + ".tmp")
+        with perf.span("yaml.write") as span:
+            with open(tmp_path, "w") as file:
+                # Ключи пишутся в порядке словаря, чтобы settings шли в начале файла
+                yaml.dump(data, file, Dumper=YAMLDumper, sort_keys=False)
+                file.flush()
+                os.fsync(file.fileno())
+                if span:
+                    span.set(bytes_written=file.tell())
+            os.replace(tmp_path, self._path)
+
+    def read_first(self, key: str) -> Optional[dict]:
+        # Читает значение key, если это первый ключ файла. Остальная часть файла не разбирается.
+        # Возвращает None, если файл начинается с другого ключа
+        with perf.span("yaml.read_first") as span, open(self._path, "r") as file:
+            loader = yaml.SafeLoader(file)
+            try:
+                for event_type in (yaml.StreamStartEvent, yaml.DocumentStartEvent, yaml.MappingStartEvent):
+                    if not isinstance(loader.get_event(), event_type):
+                        return None
+                key_node = loader.compose_node(None, None)
+                if not isinstance(key_node, yaml.ScalarNode) or key_node.value != key:
+                    return None
+                value = loader.construct_document(loader.compose_node(None, None))
+                if span:
+                    span.set(bytes_read=file.tell())
+                return value
+            finally:
+                loader.dispose()
+
+
+# Двоичный снимок данных YAML-файла для быстрой загрузки.
+# Формат: сигнатура, затем секции (длина + marshal) - отпечаток исходного файла, список ключей
+# и по секции на значение каждого ключа. Секции можно читать по отдельности
+class SnapshotFile:
+
+    signature = b"AMNESIA4"
+    header = struct.Struct("<I")
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def read(self, source_stamp: tuple[int, int], keys: Optional[list[str]] = None) -> Optional[dict]:
+        # Возвращает None, если снимка нет, он поврежден или сделан с другой версии исходного файла.
+        # Если передан keys, разбираются только нужные секции, остальные пропускаются
+        try:
+            with perf.span("snapshot.read") as span, open(self._path, "rb") as file:
+                if file.read(len(self.signature)) != self.signature:
+                    return None
+                if tuple(self._read_section(file)) != tuple(source_stamp):
+                    return None
+                stored_keys = self._read_section(file)
+                wanted = set(stored_keys if keys is None else keys)
+                data = {}
+                for key in stored_keys:
+                    if not wanted - data.keys():
+                        break
+                    if key in wanted:
+                        data[key] = self._read_section(file)
+                    else:
+                        self._skip_section(file)
+                if wanted - data.keys():
+                    return None
+                if span:
+                    span.set(bytes_read=file.tell())
+                return data
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            return None
+
+    def write(self, source_stamp: tuple[int, int], data: dict) -> None:
+        tmp_path = self._path.with_name(self._path.name + ".tmp")
+        with perf.span("snapshot.write") as span:
+            with open(tmp_path, "wb") as file:
+                file.write(self.signature)
+                self._write_section(file, list(source_stamp))
+                self._write_section(file, list(data))
+                for value in data.values():
+                    self._write_section(file, value)
+                if span:
+                    span.set(bytes_written=file.tell())
+            os.replace(tmp_path, self._path)
+
+    def _read_section(self, file):
+        size, = self.header.unpack(file.read(self.header.size))
+        return marshal.loads(file.read(size))
+
+    def _skip_section(self, file) -> None:
+        size, = self.header.unpack(file.read(self.header.size))
+        file.seek(size, os.SEEK_CUR)
+
+    def _write_section(self, file, value) -> None:
+        blob = marshal.dumps(value)
+        file.write(self.header.pack(len(blob)))
+        file.write(blob)
+
+
+class JournalFile:
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def exists(self) -> bool:
+        return self._path.exists()
+
+    def stamp(self) -> Optional[tuple[int, int]]:
+        if not self._path.exists():
+            return None
+        stat = self._path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def size(self) -> int:
+        return self._path.stat().st_size if self._path.exists() else 0
+
+    def read(self) -> list[dict]:
+        if not self._path.exists():
+            return []
+        entries = []
+        with open(self._path, "r", encoding="utf-8") as file:
+            for line in file:
+                # Последняя строка может быть недописана, если процесс упал во время записи
+                if not line.endswith("\n"):
+                    break
+                entries.append(json.loads(line))
+        return entries
+
+    def append(self, entries: list[dict]) -> None:
+        text = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with perf.span("journal.append", bytes_written=len(text)):
+            with open(self._path, "a", encoding="utf-8") as file:
+                file.write(text)
+
+    def clear(self) -> None:
+        self._path.unlink(missing_ok=True)
+
+
+# Вызывает func в фоновом потоке, когда после последнего trigger прошло delay секунд.
+# Серия вызовов trigger приводит к одному вызову func с последними аргументами.
+# Поток запускается при trigger и завершается, когда отложенных вызовов не осталось,
+# поэтому не держит объект с func после работы
+class Debouncer:
+
+    def __init__(self, func: Callable, delay: float) -> None:
+        self._func = func
+        self._delay = delay
+        self._cond = threading.Condition()
+        self._args: Optional[tuple] = None
+        self._deadline = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def trigger(self, *args) -> None:
+        with self._cond:
+            self._args = args
+            self._deadline = time.monotonic() + self._delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            else:
+                self._cond.notify()
+
+    def cancel(self) -> None:
+        with self._cond:
+            self._args = None
+            self._cond.notify()
+
+    def stop(self) -> None:
+        # Отменяет отложенный вызов и дожидается завершения потока. Следующий trigger запустит поток заново
+        with self._cond:
+            self._args = None
+            thread = self._thread
+            self._cond.notify()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def flush(self) -> None:
+        # Немедленно выполняет отложенный вызов, если он есть
+        with self._cond:
+            args, self._args = self._args, None
+            self._cond.notify()
+        if args is not None:
+            self._func(*args)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._args is None:
+                    self._thread = None
+                    return
+                timeout = self._deadline - time.monotonic()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+                args, self._args = self._args, None
+            try:
+                self._func(*args)
+            except Exception:
+                logger.exception("Background call failed")
+
+
+# Следит за изменениями файла снаружи: inotify и его аналоги через watchdog, если они недоступны - опрос.
+# Серия событий (редакторы пишут файл в несколько шагов) приводит к одному вызову callback
+class FileWatcher:
+
+    def __init__(self, path: Path, callback: Callable, delay: float) -> None:
+        self._path = path
+        self._debouncer = Debouncer(callback, delay)
+        self._observer = None
+
+    @property
+    def running(self) -> bool:
+        return self._observer is not None
+
+    def start(self) -> None:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+        from watchdog.observers.polling import PollingObserver
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+
+            def on_any_event(self, event) -> None:
+                if event.is_directory:
+                    return
+                # Многие редакторы сохраняют файл через переименование временного
+                paths = {event.src_path, getattr(event, "dest_path", "")}
+                if str(watcher._path) in paths:
+                    watcher._debouncer.trigger()
+
+        for observer_cls in (Observer, PollingObserver):
+            observer = observer_cls()
+            observer.schedule(Handler(), str(self._path.parent))
+            try:
+                observer.start()
+            except OSError:
+                logger.exception(f"{observer_cls.__name__} failed to start")
+                continue
+            self._observer = observer
+            return
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        self._debouncer.stop()